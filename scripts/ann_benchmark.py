@@ -0,0 +1,64 @@
+"""Recall vs latency of the IVF-PQ index against exact search on the passage corpus.
+
+    python scripts/ann_benchmark.py [corpus_mpnet.pkl] [index_dir]
+
+Trains (or loads from index_dir) an IVFPQIndex, then for a sample of passages
+as queries reports recall of the exact top k within the index's top k and
+top 10*k, and mean latency, at each nprobe.
+"""
+try:
+    import path  # noqa: F401
+except ImportError:
+    pass
+
+import os
+from sys import argv
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from vmware.vector.ivf import IVFPQIndex, train_from_corpus
+from vmware.vector.similarity import ExactIndex
+
+
+def benchmark(exact, index, queries, k=10, nprobes=[1, 2, 4, 8, 16, 32, 64]):
+    exact_start = perf_counter()
+    expected, _ = exact.search(queries, n=k)
+    exact_ms = 1000 * (perf_counter() - exact_start) / len(queries)
+    print(f"exact {exact_ms:.2f} ms/query (batched)")
+
+    print(f"{'nprobe':>8} {'recall@' + str(k):>10} {'recall@' + str(10 * k):>10} {'ms/query':>10}")
+    for nprobe in nprobes:
+        found_at_k = 0
+        found_at_10k = 0
+        elapsed = 0.0
+        for query, query_expected in zip(queries, expected):
+            start = perf_counter()
+            ids, _ = index.search(query, n=10 * k, nprobe=nprobe)
+            elapsed += perf_counter() - start
+            query_expected = set(query_expected.tolist())
+            found_at_k += len(query_expected & set(ids[:k].tolist()))
+            found_at_10k += len(query_expected & set(ids.tolist()))
+        total = k * len(queries)
+        print(f"{nprobe:>8} {found_at_k / total:>10.3f} {found_at_10k / total:>10.3f} "
+              f"{1000 * elapsed / len(queries):>10.2f}")
+
+
+if __name__ == "__main__":
+    corpus_path = argv[1] if len(argv) > 1 else 'corpus_mpnet.pkl'
+    index_dir = argv[2] if len(argv) > 2 else 'data/ivf_mpnet'
+    column = 'raw_text_passages_vector'
+
+    if os.path.exists(index_dir):
+        index = IVFPQIndex.load(index_dir)
+    else:
+        start = perf_counter()
+        index = train_from_corpus(corpus_path, column=column)
+        print(f"Trained and filled index in {perf_counter() - start:.1f}s")
+        index.save(index_dir)
+
+    vectors = np.stack(pd.read_pickle(corpus_path)[column].to_list())
+    exact = ExactIndex(vectors)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), 200, replace=False)]
+    benchmark(exact, index, queries)
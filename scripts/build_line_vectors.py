@@ -0,0 +1,22 @@
+"""Encode every doc's lines once at index time, for reranking to look up.
+
+    python scripts/build_line_vectors.py [out_dir] [model_name ...]
+
+Writes one MaxSimIndex per model (default all of line_vectors.line_encoders)
+under out_dir (default data/line_vectors, or VMWARE_LINE_VECTORS). Docs edited
+since, or a changed model, are encoded at query time until the next rebuild.
+"""
+import path  # noqa
+from sys import argv
+
+from elasticsearch import Elasticsearch
+from vmware.index.line_vectors import build
+from vmware.index.line_vectors import line_vectors_dir
+
+
+if __name__ == "__main__":
+    out_dir = argv[1] if len(argv) > 1 else line_vectors_dir
+    models = argv[2:] or None
+    es = Elasticsearch('http://localhost:9200', timeout=30, max_retries=10,
+                       retry_on_status=True, retry_on_timeout=True)
+    build(es, out_dir=out_dir, models=models)
@@ -3,10 +3,14 @@ try:
 except ImportError:
     pass
 
+import os
+from sys import argv
+
 import pandas as pd
-from vmware.vector.corpus import scan_to_dataframe, passage_dataframe, quantize
+from vmware.vector.corpus import scan_to_dataframe, passage_dataframe, quantize, encode_passage_shards, \
+    scan_to_parquet, iter_parquet_docs
 from elasticsearch import Elasticsearch
-from vmware.vector.mpnet import encode as encode_mpnet
+from vmware.vector.mpnet import encode as encode_mpnet, model as mpnet_model
 
 
 def quantize_encode_mpnet(text):
@@ -24,6 +28,25 @@ def build_mpnet_corpus(es):
     corpus.to_pickle('corpus_mpnet.pkl')
 
 
+def build_mpnet_shards(es, out_dir='data/passages_mpnet', corpus_dir='data/corpus_raw_text'):
+    """Stream passages through mpnet into quantized shards, resumable.
+
+    Docs are streamed from a Parquet export of the corpus (made first if
+    missing), which unlike a scan keeps the same order across resumed runs.
+    Memory stays flat however big the corpus.
+    """
+    done_path = os.path.join(corpus_dir, '_done')
+    if not os.path.exists(done_path):
+        scan_to_parquet(es, corpus_dir, fields=['raw_text'])
+        open(done_path, 'w').close()
+    docs = iter_parquet_docs(corpus_dir, columns=['id', 'raw_text'])
+    encode_passage_shards(docs, 'raw_text', mpnet_model.encode_batch, out_dir,
+                          quantizer=quantize)
+
+
 if __name__ == "__main__":
     es = Elasticsearch()
-    build_mpnet_corpus(es)
+    if len(argv) > 1 and argv[1] == 'shards':
+        build_mpnet_shards(es)
+    else:
+        build_mpnet_corpus(es)
@@ -0,0 +1,90 @@
+"""CPU encoder throughput and parity per backend, on a real mix of document lines.
+
+    python scripts/encoder_benchmark.py [num_lines] [--batching]
+
+Lines come from the GPT generated articles in gpt_articles/, which vary from
+a few words to whole paragraphs like the corpus. For USE and mpnet, reports
+lines/sec of each ModelEncoder backend, and the cosine of each backend's
+vectors to plain fp32 torch. With --batching, instead compares fixed size
+batches in arrival order against length bucketed batches.
+"""
+try:
+    import path  # noqa: F401
+except ImportError:
+    pass
+
+import json
+from sys import argv
+from time import perf_counter
+
+import numpy as np
+from vmware.vector.batching import arrival_batches, token_budget_batches, padding_efficiency
+from vmware.vector.model_encoder import ModelEncoder
+from vmware.vector.use import model_name as use_model_name
+from vmware.vector.mpnet import model_name as mpnet_model_name
+
+
+def document_lines(num_lines, filename='gpt_articles/query_database.2.json'):
+    with open(filename, 'rt') as f:
+        articles = json.load(f)['questions'].values()
+    lines = []
+    for article in articles:
+        if isinstance(article, dict):
+            article = article['article']
+        lines.extend(line for line in article.split('\n') if len(line.strip()) > 0)
+    return lines[:num_lines]
+
+
+def cosines(a, b):
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+def throughput(encoder, lines):
+    encoder.warmup(cache=False)
+    encoder.reset_stats()
+    start = perf_counter()
+    encoded = encoder.encode_batch(lines)
+    return encoded, len(lines) / (perf_counter() - start)
+
+
+def compare_batching(encoder, lines, batch_size=32):
+    """Lines/sec and padding efficiency, arrival order vs length bucketed."""
+    encoder.warmup(cache=False)
+    lengths = np.array(encoder.token_lengths(lines))
+
+    start = perf_counter()
+    for batch in arrival_batches(len(lines), batch_size=batch_size):
+        # One model call per batch, so the model can't reorder across batches
+        encoder._encode_texts([lines[idx] for idx in batch])
+    arrival_secs = perf_counter() - start
+    print(f"{encoder.model_name:<30} arrival  {len(lines) / arrival_secs:>8.1f} lines/sec  "
+          f"padding efficiency {padding_efficiency(lengths, arrival_batches(len(lines), batch_size)):.2f}")
+
+    start = perf_counter()
+    encoder.encode_batch(lines)
+    bucketed_secs = perf_counter() - start
+    print(f"{encoder.model_name:<30} bucketed {len(lines) / bucketed_secs:>8.1f} lines/sec  "
+          f"padding efficiency {padding_efficiency(lengths, token_budget_batches(lengths)):.2f}")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    lines = document_lines(int(args[0]) if len(args) > 0 else 1000)
+    print(f"{len(lines)} lines, mean {np.mean([len(line) for line in lines]):.0f} chars")
+    if '--batching' in argv:
+        for model_name, dims in [(use_model_name, 512), (mpnet_model_name, 768)]:
+            compare_batching(ModelEncoder(model_name, dims=dims), lines)
+        exit(0)
+    for model_name, dims in [(use_model_name, 512), (mpnet_model_name, 768)]:
+        baseline = None
+        for backend in ModelEncoder.BACKENDS:
+            encoder = ModelEncoder(model_name, dims=dims, backend=backend)
+            encoded, lines_per_sec = throughput(encoder, lines)
+            if baseline is None:
+                baseline = encoded
+            sims = cosines(encoded, baseline)
+            stats = encoder.stats()
+            print(f"{model_name:<30} {backend:<8} {lines_per_sec:>8.1f} lines/sec  "
+                  f"cosine to fp32 mean {sims.mean():.4f} min {sims.min():.4f}  "
+                  f"{stats['batch_size']['count']} batches, mean {stats['batch_size']['mean']:.0f} lines, "
+                  f"forward p50 {stats['forward_us']['p50'] / 1000:.0f}ms")
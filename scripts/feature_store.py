@@ -0,0 +1,31 @@
+"""Move query-doc similarity features between the sim cache in Redis and npz / Parquet files.
+
+    python scripts/feature_store.py import-hashes          # copy the old hash per pair entries
+    python scripts/feature_store.py export <path>          # sim cache -> .npz or .parquet
+    python scripts/feature_store.py load <path>            # .npz or .parquet -> sim cache
+"""
+import path  # noqa
+from sys import argv
+
+from vmware.search import passage_similarity
+from vmware.search.feature_store import FeatureStore, import_hashes
+
+
+def main(command, *args):
+    store = passage_similarity.feature_store()
+    if command == 'import-hashes':
+        print(f"Copied {import_hashes(passage_similarity.r, store)} entries")
+    elif command == 'export':
+        features = store.export()
+        features.save(args[0])
+        print(f"Exported {len(features)} rows of {len(features.queries)} queries to {args[0]}")
+    elif command == 'load':
+        features = FeatureStore.load(args[0])
+        store.load(features)
+        print(f"Loaded {len(features)} rows")
+    else:
+        raise ValueError(f"Unknown command {command}")
+
+
+if __name__ == "__main__":
+    main(*argv[1:])
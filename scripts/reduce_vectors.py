@@ -0,0 +1,39 @@
+"""Fit a dimension reducer on a corpus sample and report its quality vs size tradeoff.
+
+    python scripts/reduce_vectors.py [corpus_mpnet.pkl] [dims] [reducer.npz]
+
+Prints recall@10 (vs full size vectors) for PCA and truncation at several
+sizes, then fits a PCA reducer at dims on the whole sample and saves it, for
+use with an enrichment's reduced() and at query time.
+"""
+try:
+    import path  # noqa: F401
+except ImportError:
+    pass
+
+from sys import argv
+
+import numpy as np
+import pandas as pd
+from vmware.vector.reduce import Reducer, tradeoff_report
+
+
+if __name__ == "__main__":
+    corpus_path = argv[1] if len(argv) > 1 else 'corpus_mpnet.pkl'
+    dims = int(argv[2]) if len(argv) > 2 else 128
+    reducer_path = argv[3] if len(argv) > 3 else f'data/reducer_{dims}.npz'
+    column = 'raw_text_passages_vector'
+
+    # uint8 quantize() codes, dequantized by fit_pca / tradeoff_report
+    vectors = np.stack(pd.read_pickle(corpus_path)[column].to_list())
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), 50000), replace=False)]
+    print(f"{len(sample)} of {len(vectors)} vectors, {vectors.shape[1]} dims")
+
+    print(f"{'method':>12} {'dims':>6} {'bytes':>8} {'size':>6} {'recall@10':>10}")
+    for row in tradeoff_report(sample):
+        print(f"{row['method']:>12} {row['dims']:>6} {row['bytes_per_vector']:>8} "
+              f"{row['size_vs_full']:>6.2f} {row['recall@10']:>10.3f}")
+
+    Reducer.fit_pca(sample, dims).save(reducer_path)
+    print(f"Saved {dims} dim PCA reducer to {reducer_path}")
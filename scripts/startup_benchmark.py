@@ -0,0 +1,47 @@
+"""Time importing the encoder / search modules, each in a fresh interpreter.
+
+    python scripts/startup_benchmark.py [--warmup]
+
+Imports should stay well under a second - models and connections load on
+first use. With --warmup, also times loading every model up front.
+"""
+import subprocess
+import sys
+from sys import argv
+
+modules = ['vmware.vector.mpnet',
+           'vmware.vector.use',
+           'vmware.vector.msmarco_distilbert',
+           'vmware.search.passage_similarity',
+           'vmware.search.rerank_simple_slop_search']
+
+heavy_modules = ['sentence_transformers', 'torch']
+
+timer = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(perf_counter() - start, [heavy for heavy in {heavy_modules} if heavy in sys.modules])
+"""
+
+
+def time_import(module):
+    output = subprocess.run([sys.executable, '-c', timer.format(module=module, heavy_modules=heavy_modules)],
+                            capture_output=True, text=True, check=True).stdout
+    elapsed, loaded = output.split(' ', 1)
+    return float(elapsed), loaded.strip()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, '.')
+    for module in modules:
+        elapsed, loaded = time_import(module)
+        print(f"{module:<45} {elapsed:>6.2f}s  heavy modules loaded: {loaded}")
+
+    if '--warmup' in argv:
+        from time import perf_counter
+        from vmware.search.passage_similarity import warmup
+        start = perf_counter()
+        warmup()
+        print(f"{'warmup()':<45} {perf_counter() - start:>6.2f}s")
@@ -0,0 +1,37 @@
+"""List, measure and drop vector cache namespaces in Redis.
+
+    python scripts/vector_cache.py list
+    python scripts/vector_cache.py drop <prefix>
+    python scripts/vector_cache.py compact <model_name>   # drop all but current model version
+
+compact fingerprints the model as ModelEncoder does, a digest of the weights, so it loads
+(and if needed downloads) the model when its files aren't in a folder model_fingerprint knows.
+"""
+import path  # noqa
+from sys import argv
+
+import redis
+from vmware.vector.vector_cache import scan_namespaces, drop_namespace
+from vmware.vector.model_encoder import ModelEncoder
+
+
+def main(r, command, *args):
+    if command == 'list':
+        for prefix, summary in sorted(scan_namespaces(r).items()):
+            print(f"{prefix:<60} {summary['keys']:>10} keys {summary['bytes'] / 1024 / 1024:>10.1f} MB")
+    elif command == 'drop':
+        print(f"Dropped {drop_namespace(r, args[0])} keys")
+    elif command == 'compact':
+        model_name = args[0]
+        namespace = model_name.replace("/", "_")
+        # The fp32 fingerprint, every backend's keys are under it. Never the name alone, which
+        # would drop every valid key
+        fingerprint = ModelEncoder(model_name, dims=0, backend='torch').fingerprint
+        print(f"Keeping {namespace}:{fingerprint}")
+        print(f"Dropped {drop_namespace(r, namespace, keep=fingerprint)} keys")
+    else:
+        raise ValueError(f"Unknown command {command}")
+
+
+if __name__ == "__main__":
+    main(redis.Redis(host='localhost', port=6379), *argv[1:])
@@ -0,0 +1,151 @@
+import asyncio
+import numpy as np
+from vmware.vector.model_encoder import ModelEncoder, AsyncModelEncoder
+from vmware.vector.vector_cache import VectorCache, AsyncVectorCache, LRUVectorCache
+
+
+class DictRedis:
+    """Just the Redis calls the vector caches make, over a dict."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def set(self, key, value):
+        self.data[key] = bytes(value)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+class AsyncPipeline(DictRedis):
+    """redis.asyncio pipelines queue commands synchronously, only execute() is awaited."""
+
+    async def execute(self):
+        return []
+
+
+class AsyncDictRedis(DictRedis):
+
+    def pipeline(self, transaction=True):
+        return AsyncPipeline(self.data)
+
+    async def set(self, key, value):
+        super().set(key, value)
+
+    async def get(self, key):
+        return super().get(key)
+
+    async def mget(self, keys):
+        return super().mget(keys)
+
+
+class FakeModel:
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        return np.array([np.full(4, len(text)) for text in texts], dtype=np.float32)
+
+
+def test_async_and_sync_caches_share_keys():
+    data = {}
+    sync_cache = VectorCache(DictRedis(data), 'model', dims=4, dtype=np.float32, fingerprint='abc')
+    async_cache = AsyncVectorCache(AsyncDictRedis(data), 'model', dims=4, dtype=np.float32, fingerprint='abc')
+    sync_cache.set_many(['a', 'b'], np.array([[1, 2, 3, 4], [5, 6, 7, 8]], dtype=np.float32))
+
+    async def read():
+        await async_cache.set('c', np.full(4, 9.0, dtype=np.float32))
+        return await async_cache.get_many(['b', 'missing', 'a'])
+
+    vectors, missed = asyncio.run(read())
+    assert missed == [1]
+    assert (vectors[0] == [5, 6, 7, 8]).all()
+    assert (vectors[2] == [1, 2, 3, 4]).all()
+    assert (sync_cache.get('c') == 9.0).all()
+
+
+def test_async_encoder_encodes_misses_once():
+    encoder = ModelEncoder('fake', dims=4, fingerprint='abc')
+    encoder._model = FakeModel()
+    async_encoder = AsyncModelEncoder(encoder, r=AsyncDictRedis({}))
+
+    async def encode_concurrently():
+        first = await async_encoder.encode_batch(['a', 'bb', 'bb'], cached=True)
+        rest = await asyncio.gather(async_encoder.encode('a', cached=True),
+                                    async_encoder.encode('bb', cached=True))
+        return first, rest
+
+    first, rest = asyncio.run(encode_concurrently())
+    assert (first[:, 0] == [1, 2, 2]).all()
+    assert (rest[0] == 1).all() and (rest[1] == 2).all()
+    assert encoder._model.calls == 1
+    assert async_encoder.stats()['cache_hits'] == 2
+
+
+def test_async_encoder_shares_cache_dir_with_sync(tmp_path):
+    encoder = ModelEncoder('fake', dims=4, fingerprint='abc', cache_dir=str(tmp_path))
+    encoder._model = FakeModel()
+    encoder.encode_batch(['a', 'bb'], cached=True)
+    async_encoder = AsyncModelEncoder(encoder)
+
+    async def encode():
+        return await async_encoder.encode_batch(['bb', 'ccc', 'a'], cached=True)
+
+    encoded = asyncio.run(encode())
+    assert (encoded[:, 0] == [2, 3, 1]).all()
+    assert encoder._model.calls == 2
+    assert async_encoder.stats()['cache_hits'] == 2
+    assert (encoder.cache.get('ccc') == 3).all()
+
+
+def test_async_cache_created_once():
+    encoder = ModelEncoder('fake', dims=4, fingerprint='abc')
+    async_encoder = AsyncModelEncoder(encoder, r=AsyncDictRedis({}))
+
+    async def first_calls():
+        return await asyncio.gather(*[async_encoder.cache() for _ in range(5)])
+
+    caches = asyncio.run(first_calls())
+    assert all(cache is caches[0] for cache in caches)
+
+
+class ThirdsModel(FakeModel):
+    """Vectors float16 can't hold exactly."""
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        return super().encode(texts, **kwargs) / 3
+
+
+def test_f16_misses_match_hits():
+    data = {}
+    encoder = ModelEncoder('fake', dims=4, fingerprint='abc', storage='f16')
+    encoder._model = ThirdsModel()
+    encoder._cache = LRUVectorCache(VectorCache(DictRedis(data), 'fake', dims=4, dtype=np.float32,
+                                                fingerprint='abc', storage='f16'))
+    missed = encoder.encode_batch(['a', 'bb'], cached=True)
+    assert not (missed == np.array([[1 / 3] * 4, [2 / 3] * 4], dtype=np.float32)).all()
+    # Local (LRU) hits, remote (Redis) hits and single encodes all agree with the misses
+    assert (encoder.encode_batch(['a', 'bb'], cached=True) == missed).all()
+    assert (encoder._cache.backing.get_many(['a', 'bb'])[0] == missed).all()
+    assert (encoder.encode('ccc', cached=True) == encoder._cache.backing.get('ccc')).all()
+
+    async_encoder = AsyncModelEncoder(encoder, r=AsyncDictRedis({}))
+
+    async def encode_twice():
+        return [await async_encoder.encode_batch(['dddd'], cached=True) for _ in range(2)]
+
+    first, second = asyncio.run(encode_twice())
+    assert (first == second).all()
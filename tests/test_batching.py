@@ -0,0 +1,36 @@
+import numpy as np
+from vmware.vector.batching import token_budget_batches, arrival_batches, padding_efficiency, \
+    encode_bucketed
+
+
+lengths = np.array([3, 120, 5, 4, 60, 7, 200, 3, 9, 15] * 10)
+
+
+def test_batches_cover_every_text_once():
+    batches = token_budget_batches(lengths, max_tokens=400, max_batch=16)
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+
+
+def test_batches_within_budget():
+    for batch in token_budget_batches(lengths, max_tokens=400, max_batch=16):
+        assert len(batch) <= 16
+        assert len(batch) == 1 or len(batch) * lengths[batch].max() <= 400
+
+
+def test_bucketing_pads_less_than_arrival_order():
+    bucketed = padding_efficiency(lengths, token_budget_batches(lengths, max_tokens=400, max_batch=16))
+    arrival = padding_efficiency(lengths, arrival_batches(len(lengths), batch_size=16))
+    assert bucketed > 2 * arrival
+
+
+def test_encode_bucketed_restores_order():
+    texts = ['x' * length for length in lengths]
+    batch_sizes = []
+
+    def encode(batch):
+        batch_sizes.append(len(batch))
+        return np.array([[len(text)] for text in batch], dtype=np.float32)
+
+    encoded = encode_bucketed(encode, texts, lengths=lengths, max_tokens=400, max_batch=16)
+    assert encoded[:, 0].tolist() == lengths.tolist()
+    assert len(batch_sizes) > 1
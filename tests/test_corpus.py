@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from vmware.vector.corpus import encode_passage_shards, read_passage_shards
+
+
+def fake_encode_batch(texts):
+    return np.array([[len(text), text.count('a')] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def docs():
+    return [{'id': f"doc{idx}", 'raw_text': '\n'.join(['a' * line for line in range(idx + 1)])}
+            for idx in range(10)]
+
+
+def read_all(out_dir):
+    vectors, doc_ids, lengths = [], [], []
+    for shard_vectors, offsets, shard_doc_ids in read_passage_shards(out_dir):
+        vectors.append(np.asarray(shard_vectors))
+        doc_ids.extend(shard_doc_ids.tolist())
+        lengths.extend(np.diff(offsets).tolist())
+    return np.concatenate(vectors), doc_ids, lengths
+
+
+def test_shards_hold_every_passage(tmp_path, docs):
+    manifest = encode_passage_shards(docs, 'raw_text', fake_encode_batch, str(tmp_path),
+                                     shard_size=7, batch_size=4)
+    assert len(manifest['shards']) > 1
+    vectors, doc_ids, lengths = read_all(str(tmp_path))
+    assert doc_ids == [doc['id'] for doc in docs]
+    assert lengths == list(range(1, 11))
+    assert vectors[:, 0].tolist() == [float(line) for idx in range(10) for line in range(idx + 1)]
+
+
+def test_shards_resume_after_crash(tmp_path, docs):
+    calls = []
+
+    def crashing_encode_batch(texts):
+        calls.append(len(texts))
+        if len(calls) > 5:
+            raise RuntimeError("Crashed")
+        return fake_encode_batch(texts)
+
+    with pytest.raises(RuntimeError):
+        encode_passage_shards(docs, 'raw_text', crashing_encode_batch, str(tmp_path / 'resumed'),
+                              shard_size=7, batch_size=4)
+    encode_passage_shards(docs, 'raw_text', fake_encode_batch, str(tmp_path / 'resumed'),
+                          shard_size=7, batch_size=4)
+    encode_passage_shards(docs, 'raw_text', fake_encode_batch, str(tmp_path / 'clean'),
+                          shard_size=7, batch_size=4)
+
+    resumed = read_all(str(tmp_path / 'resumed'))
+    clean = read_all(str(tmp_path / 'clean'))
+    assert (resumed[0] == clean[0]).all()
+    assert resumed[1:] == clean[1:]
+
+
+def test_scan_to_parquet_chunks(tmp_path, docs, monkeypatch):
+    pytest.importorskip('pyarrow')
+    from vmware.vector import corpus
+
+    def fake_scan(es, index, scroll, size, request_timeout, query):
+        for doc in docs:
+            yield {'_id': doc['id'],
+                   '_source': {field: doc.get(field) for field in query['_source']}}
+
+    monkeypatch.setattr(corpus.elasticsearch.helpers, 'scan', fake_scan)
+    out_dir = str(tmp_path / 'corpus')
+    assert corpus.scan_to_parquet(None, out_dir, fields=['raw_text', 'title'], chunk_size=4) == 10
+    assert len(list((tmp_path / 'corpus').glob('part-*.parquet'))) == 3
+
+    exported = corpus.read_parquet_corpus(out_dir, columns=['id', 'raw_text'])
+    assert list(exported.columns) == ['id', 'raw_text']
+    assert exported['id'].tolist() == [doc['id'] for doc in docs]
+    assert exported['raw_text'].tolist() == [doc['raw_text'] for doc in docs]
+    assert [doc['id'] for doc in corpus.iter_parquet_docs(out_dir, columns=['id'], batch_size=3)] == \
+        exported['id'].tolist()
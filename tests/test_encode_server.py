@@ -0,0 +1,93 @@
+import threading
+import numpy as np
+import pytest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from vmware.vector.encode_server import make_server, EncodeClient
+
+
+def fake_encode_batch(texts):
+    encoded = np.zeros((len(texts), 768), dtype=np.float32)
+    encoded[:, 0] = [len(text) for text in texts]
+    return encoded
+
+
+@pytest.fixture
+def server():
+    server = make_server({'all-mpnet-base-v2': fake_encode_batch}, port=0,
+                         max_batch=64, max_wait=0.05)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f"http://localhost:{server.server_address[1]}"
+
+
+def test_batch_endpoint_in_order(server):
+    texts = ['a', 'bbb', 'cc']
+    encoded = EncodeClient(url(server)).encode('all-mpnet-base-v2', texts)
+    assert encoded.shape == (3, 768)
+    assert encoded[:, 0].tolist() == [1.0, 3.0, 2.0]
+
+
+def test_concurrent_requests_micro_batched(server):
+    client = EncodeClient(url(server))
+    docs = [['x' * (doc + line) for line in range(5)] for doc in range(20)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(lambda lines: client.encode('all-mpnet-base-v2', lines), docs))
+    for lines, encoded in zip(docs, results):
+        assert encoded[:, 0].tolist() == [float(len(line)) for line in lines]
+    stats = server.batchers['all-mpnet-base-v2'].metrics.snapshot()
+    assert stats['texts'] == 100
+    assert stats['batch_size']['max'] > 5
+    assert stats['batch_size']['count'] < 100
+
+
+def test_single_text_get(server):
+    resp = requests.get(f"{url(server)}/encode/all-mpnet-base-v2", params={'q': 'abcd'})
+    assert resp.json()['encoded'][0] == 4.0
+
+
+def test_unknown_model(server):
+    with pytest.raises(RuntimeError):
+        EncodeClient(url(server)).encode('nope', ['a'])
+
+
+def test_mpnet_enrichment_end_to_end(server):
+    from vmware.index.sentence_transformer import _mpnet_encode, _mpnet_passages_server_encode
+
+    doc = {'first_line': 'Title', 'remaining_lines': ['short', 'a long enough line']}
+    _mpnet_encode(doc, encoder=lambda lines: _mpnet_passages_server_encode(lines, url(server)))
+    assert doc['raw_text_mean_mpnet'][0] == pytest.approx((5 + 18) / 2)
+
+
+@pytest.mark.parametrize("body", ['["a"]', '"a"', '{"texts": "a"}', '{"texts": [1, 2]}', '{}', 'not json'])
+def test_malformed_post_is_400(server, body):
+    resp = requests.post(f"{url(server)}/encode/all-mpnet-base-v2", data=body)
+    assert resp.status_code == 400
+
+
+def test_wrong_row_count_is_500():
+    server = make_server({'short': lambda texts: np.zeros((len(texts) - 1, 4), dtype=np.float32)}, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        resp = requests.post(f"{url(server)}/encode/short", json={'texts': ['a', 'b']})
+        assert resp.status_code == 500
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_mpnet_encode_lines_is_mean_vector(monkeypatch):
+    from vmware.index import sentence_transformer
+
+    monkeypatch.setattr(sentence_transformer.model, 'encode_batch', fake_encode_batch)
+    mean = sentence_transformer._mpnet_encode_lines(['a', 'bbb'])
+    # One 768 dim vector (the mean over lines), not a scalar mean of every element
+    assert mean.shape == (768,)
+    assert mean[0] == pytest.approx(2.0)
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from vmware.search.feature_store import FeatureStore, RedisFeatureStore, import_hashes
+
+
+FIELDS = ['max_sim_use', 'mean_sim_use', 'max_sim_mpnet']
+
+
+class DictRedis:
+    """The string, hash and scan calls the stores make, over a dict."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def hmget(self, key, fields):
+        return [self.values.get(key, {}).get(field) for field in fields]
+
+    def scan_iter(self, match, count=None, _type=None):
+        prefix = match.rstrip('*')
+        return [key.encode('utf-8') for key, value in list(self.values.items())
+                if key.startswith(prefix) and (_type != 'hash' or isinstance(value, dict))]
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Pipeline:
+
+    def __init__(self, r):
+        self.r = r
+        self.queued = []
+
+    def set(self, key, value):
+        self.queued.append(lambda: self.r.set(key, value))
+
+    def hmget(self, key, fields):
+        self.queued.append(lambda: self.r.hmget(key, fields))
+
+    def execute(self):
+        return [command() for command in self.queued]
+
+
+def filled_store(num_rows=2500):
+    rng = np.random.default_rng(0)
+    store = FeatureStore(FIELDS)
+    queries = [f"query {idx % 37}" for idx in range(num_rows)]
+    doc_ids = [f"doc{idx % 101}" for idx in range(num_rows)]
+    values = rng.random((num_rows, len(FIELDS)))
+    store.put_many(queries, doc_ids, values)
+    return store, queries, doc_ids, values.astype(np.float32)
+
+
+def test_put_get_interns_and_overwrites():
+    store, queries, doc_ids, values = filled_store()
+    pairs = dict(zip(zip(queries, doc_ids), values))
+    assert len(store) == len(pairs)
+    assert len(store.queries) == 37
+    assert len(store.docs) == 101
+
+    found, missed = store.get_many(queries + ['unseen'], doc_ids + ['doc1'])
+    assert missed == [len(queries)]
+    assert np.isnan(found[-1]).all()
+    # Later rows of a repeated pair win
+    assert np.array_equal(found[:-1], np.array([pairs[pair] for pair in zip(queries, doc_ids)]))
+
+    store.put('query 0', 'doc0', [1.0, 2.0, 3.0])
+    assert store.get('query 0', 'doc0').tolist() == [1.0, 2.0, 3.0]
+    assert store.get('query 0', 'doc1') is None
+    with pytest.raises(ValueError):
+        store.put('query 0', 'doc0', [1.0])
+
+
+@pytest.mark.parametrize("file_name", ["features.npz", "features.parquet"])
+def test_save_load_round_trip(tmp_path, file_name):
+    store, queries, doc_ids, _ = filled_store()
+    path = str(tmp_path / file_name)
+    store.save(path)
+    loaded = FeatureStore.load(path)
+    assert loaded.fields == FIELDS
+    assert len(loaded) == len(store)
+    assert np.array_equal(loaded.get_many(queries, doc_ids)[0], store.get_many(queries, doc_ids)[0])
+    assert loaded.to_dataframe().equals(store.to_dataframe())
+
+
+def test_redis_store_point_lookups_and_export():
+    r = DictRedis()
+    online = RedisFeatureStore(r, FIELDS)
+    store, queries, doc_ids, _ = filled_store(300)
+    online.load(store, batch_size=64)
+    assert online.get('query 1', 'doc1').tolist() == store.get('query 1', 'doc1').tolist()
+    assert online.get('query 1', 'doc2') is None
+
+    found, missed = online.get_many(['query 1', 'query 2'], ['doc1', 'doc1000'])
+    assert missed == [1]
+    assert np.isnan(found[1]).all()
+
+    exported = online.export(count=50)
+    assert len(exported) == len(store)
+    assert np.array_equal(exported.get_many(queries, doc_ids)[0], store.get_many(queries, doc_ids)[0])
+
+
+def test_import_hashes_skips_incomplete():
+    r = DictRedis()
+    r.values['sim:upgrade vcenter|||doc1'] = {field: str(0.25 * idx).encode('utf-8')
+                                              for idx, field in enumerate(FIELDS)}
+    r.values['sim:upgrade vcenter|||doc2'] = {FIELDS[0]: b'0.5'}
+    online = RedisFeatureStore(r, FIELDS)
+    assert import_hashes(r, online) == 1
+    assert online.get('upgrade vcenter', 'doc1').tolist() == [0.0, 0.25, 0.5]
+    assert online.get('upgrade vcenter', 'doc2') is None
+
+
+def test_redis_store_other_fields_miss():
+    r = DictRedis()
+    RedisFeatureStore(r, FIELDS).set('upgrade vcenter', 'doc1', [0.1, 0.2, 0.3])
+    # Same number of fields, in another order
+    reordered = RedisFeatureStore(r, [FIELDS[1], FIELDS[0], FIELDS[2]])
+    assert reordered.get('upgrade vcenter', 'doc1') is None
+    assert reordered.get_many(['upgrade vcenter'], ['doc1'])[1] == [0]
+    assert len(reordered.export()) == 0
+    assert reordered.key('upgrade vcenter', 'doc1').startswith(f"simf:{reordered.schema}:")
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from vmware.vector.ivf import IVFPQIndex
+from vmware.vector.similarity import ExactIndex
+
+
+@pytest.fixture(scope='module')
+def clustered():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 32))
+    vectors = centers[rng.integers(0, 20, size=3000)] + 0.3 * rng.normal(size=(3000, 32))
+    return vectors.astype(np.float32)
+
+
+@pytest.fixture(scope='module')
+def index(clustered):
+    index = IVFPQIndex.train(clustered, nlist=16, m=8, iters=10)
+    index.add(clustered)
+    return index
+
+
+def recall_at(index, exact, queries, k, depth, nprobe):
+    """Fraction of the exact top k found in the index's top depth."""
+    found = 0
+    for query in queries:
+        expected, _ = exact.search(query, n=k)
+        ids, _ = index.search(query, n=depth, nprobe=nprobe)
+        found += len(set(ids.tolist()) & set(expected.tolist()))
+    return found / (k * len(queries))
+
+
+def test_ivf_recall_grows_with_nprobe(clustered, index):
+    exact = ExactIndex(clustered)
+    queries = clustered[:50] + 0.05
+    low = recall_at(index, exact, queries, k=10, depth=50, nprobe=1)
+    high = recall_at(index, exact, queries, k=10, depth=50, nprobe=16)
+    assert high >= low
+    assert high > 0.7
+
+
+def test_ivf_finds_itself(clustered, index):
+    ids, scores = index.search(clustered[7], n=5, nprobe=16)
+    assert 7 in ids.tolist()
+    assert (np.diff(scores) <= 0).all()
+
+
+def test_ivf_save_load(tmp_path, clustered, index):
+    index.save(str(tmp_path / 'ivf'))
+    loaded = IVFPQIndex.load(str(tmp_path / 'ivf'))
+    assert isinstance(loaded.codes, np.memmap)
+    ids, scores = index.search(clustered[0], n=10, nprobe=4)
+    loaded_ids, loaded_scores = loaded.search(clustered[0], n=10, nprobe=4)
+    assert ids.tolist() == loaded_ids.tolist()
+    assert scores == pytest.approx(loaded_scores)
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+
+def imported_after(module):
+    code = f"import sys; import {module}; print(sorted(sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True).stdout
+    return output
+
+
+def test_encoders_import_without_loading_models():
+    for module in ['vmware.vector.mpnet', 'vmware.vector.use', 'vmware.vector.msmarco_distilbert']:
+        loaded = imported_after(module)
+        assert "'sentence_transformers" not in loaded
+        assert "'torch" not in loaded
+
+
+def test_encoders_do_not_connect_at_import():
+    code = ("import vmware.vector.mpnet as mpnet, vmware.vector.model_encoder as model_encoder; "
+            "print(mpnet.model._model is None and mpnet.model._cache is None and model_encoder._redis is None)")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'True'
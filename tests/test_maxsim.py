@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from vmware.vector.maxsim import MaxSimIndex, FEATURES
+
+
+@pytest.fixture
+def docs():
+    rng = np.random.default_rng(0)
+    doc_ids = [f"doc{idx}" for idx in range(20)]
+    line_vectors = [rng.normal(size=(rng.integers(1, 15), 8)).astype(np.float32)
+                    for _ in doc_ids]
+    return doc_ids, line_vectors
+
+
+def looped_features(query, lines):
+    """Same running max / sum as passage_similarity_long_lines."""
+    sims = [np.dot(line, query) / (np.linalg.norm(line) * np.linalg.norm(query)) for line in lines]
+    return {'first_line_sim': sims[0],
+            'max_sim': max(sims), 'max_sim_5': max(sims[:5]), 'max_sim_10': max(sims[:10]),
+            'sum_sim': sum(sims), 'sum_sim_5': sum(sims[:5]), 'sum_sim_10': sum(sims[:10]),
+            'mean_sim': sum(sims) / len(sims),
+            'mean_sim_5': sum(sims[:5]) / min(len(sims), 5),
+            'mean_sim_10': sum(sims[:10]) / min(len(sims), 10)}
+
+
+def test_maxsim_matches_looped(docs):
+    doc_ids, line_vectors = docs
+    index = MaxSimIndex.build(doc_ids, line_vectors)
+    query = np.ones(8, dtype=np.float32)
+    candidates = ['doc3', 'doc0', 'doc19', 'doc7']
+    features = index.features(query, candidates)
+    for pos, doc_id in enumerate(candidates):
+        expected = looped_features(query, line_vectors[doc_ids.index(doc_id)])
+        for feature in FEATURES:
+            assert features[feature][pos] == pytest.approx(expected[feature], abs=1e-5)
+
+
+def test_maxsim_save_load(tmp_path, docs):
+    doc_ids, line_vectors = docs
+    index = MaxSimIndex.build(doc_ids, line_vectors)
+    index.save(str(tmp_path / 'maxsim'))
+    loaded = MaxSimIndex.load(str(tmp_path / 'maxsim'))
+    assert 'doc5' in loaded
+    query = np.ones(8, dtype=np.float32)
+    assert loaded.features(query, ['doc5'])['max_sim'] == \
+        pytest.approx(index.features(query, ['doc5'])['max_sim'])
+
+
+def test_maxsim_rejects_empty_docs():
+    with pytest.raises(ValueError):
+        MaxSimIndex.build(['a'], [np.empty((0, 8), dtype=np.float32)])
+
+
+def test_maxsim_write_matches_build(tmp_path, docs):
+    doc_ids, line_vectors = docs
+    texts = [[f"{doc_id} line {idx}" for idx in range(len(lines))] for doc_id, lines in zip(doc_ids, line_vectors)]
+    vectors_by_text = {text: vector for doc_texts, lines in zip(texts, line_vectors)
+                       for text, vector in zip(doc_texts, lines)}
+    written = MaxSimIndex.write(str(tmp_path / 'written'), zip(doc_ids, texts),
+                                lambda batch: np.array([vectors_by_text[text] for text in batch]),
+                                batch_lines=7)
+    built = MaxSimIndex.build(doc_ids, line_vectors)
+    assert np.allclose(written.vectors, built.vectors)
+    assert (written.offsets == built.offsets).all()
+    assert np.allclose(written.lines('doc4'), built.lines('doc4'))
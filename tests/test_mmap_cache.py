@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from vmware.vector import mmap_cache
+from vmware.vector.mmap_cache import MmapVectorCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'model')
+
+
+def test_mmap_cache_round_trip(path):
+    cache = MmapVectorCache(path, dims=4)
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    cache.set_many(['a', 'b', 'c'], vectors)
+
+    found, missed = cache.get_many(['c', 'x', 'a'])
+    assert missed == [1]
+    assert (found[0] == vectors[2]).all()
+    assert (found[2] == vectors[0]).all()
+    assert (cache.get('b') == vectors[1]).all()
+
+
+def test_mmap_cache_does_not_append_existing_keys(path):
+    cache = MmapVectorCache(path, dims=4)
+    cache.set('a', np.ones(4, dtype=np.float32))
+    cache.set('a', np.zeros(4, dtype=np.float32))
+    assert len(cache) == 1
+    assert (cache.get('a') == 1.0).all()
+
+
+def test_mmap_cache_seen_by_other_readers(path):
+    writer = MmapVectorCache(path, dims=4)
+    reader = MmapVectorCache(path, dims=4)
+    writer.set('a', np.ones(4, dtype=np.float32))
+    assert (reader.get('a') == 1.0).all()
+
+    reopened = MmapVectorCache(path, dims=4)
+    assert len(reopened) == 1
+    assert (reopened.get('a') == 1.0).all()
+
+
+def test_mmap_cache_index_merges(path, monkeypatch):
+    monkeypatch.setattr(mmap_cache, 'MERGE_PENDING_AT', 2)
+    cache = MmapVectorCache(path, dims=4)
+    keys = [str(idx) for idx in range(10)]
+    vectors = np.arange(40, dtype=np.float32).reshape(10, 4)
+    for key, vector in zip(keys, vectors):
+        cache.set(key, vector)
+    found, missed = cache.get_many(keys)
+    assert missed == []
+    assert (found == vectors).all()
+
+
+def test_mmap_cache_rejects_other_model_version(path):
+    MmapVectorCache(path, dims=4, fingerprint='v1')
+    with pytest.raises(ValueError):
+        MmapVectorCache(path, dims=4, fingerprint='v2')
+
+
+def test_mmap_cache_uint8(path):
+    cache = MmapVectorCache(path, dims=4, dtype=np.uint8)
+    cache.set('a', np.array([0, 1, 254, 255], dtype=np.uint8))
+    assert cache.get('a').tolist() == [0, 1, 254, 255]
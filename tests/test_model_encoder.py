@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pytest
+from vmware.vector import model_encoder
+from vmware.vector.model_encoder import ModelEncoder
+
+
+lines = ["How do I migrate a virtual machine between hosts with vMotion?",
+         "ESXi host disconnects from vCenter Server after upgrade",
+         "Resolution",
+         "To work around this issue, restart the management agents on the ESXi host "
+         "from the Direct Console User Interface (DCUI) or the ESXi shell."]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        ModelEncoder('all-mpnet-base-v2', dims=768, backend='gpu')
+
+
+def test_backends_cached_separately(monkeypatch):
+    monkeypatch.setattr(model_encoder, '_model_path', lambda model_name: '/models/mpnet')
+    monkeypatch.setattr(model_encoder, 'model_fingerprint', lambda model_name: 'abc')
+    fp32 = ModelEncoder('all-mpnet-base-v2', dims=768, backend='torch')
+    int8 = ModelEncoder('all-mpnet-base-v2', dims=768, backend='int8')
+    assert fp32.fingerprint == 'abc'
+    assert int8.fingerprint == 'abc:int8'
+    # Even when the model version is given
+    assert ModelEncoder('all-mpnet-base-v2', dims=768, backend='int8', fingerprint='v1').fingerprint == 'v1:int8'
+    assert ModelEncoder('all-mpnet-base-v2', dims=768, fingerprint='v1').fingerprint == 'v1'
+
+
+@pytest.mark.parametrize("model_name,dims", [('ronanki/ml_use_512_MNR_15', 512),
+                                             ('all-mpnet-base-v2', 768)])
+def test_int8_parity_with_fp32(model_name, dims):
+    pytest.importorskip('sentence_transformers')
+    fp32_encoder = ModelEncoder(model_name, dims=dims, backend='torch')
+    try:
+        fp32_encoder.model
+    except OSError as e:
+        pytest.skip(f"{model_name} not downloadable here - {e}")
+    fp32 = fp32_encoder.encode_batch(lines)
+    int8 = ModelEncoder(model_name, dims=dims, backend='int8').encode_batch(lines)
+    assert int8.shape == (len(lines), dims)
+    cosines = (fp32 * int8).sum(axis=1) / (np.linalg.norm(fp32, axis=1) * np.linalg.norm(int8, axis=1))
+    assert cosines.min() > 0.95
+
+
+def test_fingerprint_covers_weight_contents(tmp_path):
+    model_dir = tmp_path / 'model'
+    model_dir.mkdir()
+    (model_dir / 'config.json').write_text('{"hidden_size": 4}')
+    (model_dir / 'model.bin').write_bytes(b'\x00' * 64)
+    base = model_encoder.model_fingerprint(str(model_dir))
+    assert model_encoder.model_fingerprint(str(model_dir)) == base
+    # Same size, fine tuned weights
+    (model_dir / 'model.bin').write_bytes(b'\x01' * 64)
+    mtime_ns = (model_dir / 'model.bin').stat().st_mtime_ns + 10 ** 9
+    os.utime(model_dir / 'model.bin', ns=(mtime_ns, mtime_ns))
+    assert model_encoder.model_fingerprint(str(model_dir)) != base
+
+
+def test_strict_fingerprint_needs_local_files():
+    with pytest.raises(FileNotFoundError):
+        model_encoder.model_fingerprint('not-a-downloaded-model', strict=True)
+    with pytest.warns(UserWarning):
+        assert model_encoder.model_fingerprint('not-a-downloaded-model')
+
+
+def test_fingerprint_of_loaded_weights_when_files_not_found(monkeypatch):
+    torch = pytest.importorskip('torch')
+    sentence_transformers = pytest.importorskip('sentence_transformers')
+    weights = {'value': 0.5}
+
+    def load(model_name, **kwargs):
+        layer = torch.nn.Linear(4, 4)
+        torch.nn.init.constant_(layer.weight, weights['value'])
+        torch.nn.init.zeros_(layer.bias)
+        return layer
+
+    monkeypatch.setattr(sentence_transformers, 'SentenceTransformer', load)
+    monkeypatch.setattr(model_encoder, '_model_path', lambda model_name: None)
+    base = ModelEncoder('hub-model', dims=4).fingerprint
+    assert ModelEncoder('hub-model', dims=4).fingerprint == base
+    # Backends share the fp32 fingerprint, so compact keeps them all
+    assert ModelEncoder('hub-model', dims=4, backend='int8').fingerprint == f"{base}:int8"
+    weights['value'] = 0.25
+    assert ModelEncoder('hub-model', dims=4).fingerprint != base
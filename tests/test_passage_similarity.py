@@ -0,0 +1,242 @@
+import numpy as np
+import pytest
+from numpy import dot
+from numpy.linalg import norm
+from vmware.search import passage_similarity
+from vmware.search.passage_similarity import passage_similarity_long_lines, score_hits, cached_fields, \
+    ScoringContext
+from vmware.vector.maxsim import MaxSimIndex
+
+
+def fake_encode(text, cached=False, dims=16):
+    rng = np.random.default_rng(sum(text.encode('utf-8')) + len(text))
+    return rng.normal(size=dims).astype(np.float32)
+
+
+def fake_encode_batch(texts, cached=False):
+    return np.array([fake_encode(text) for text in texts])
+
+
+class KVRedis:
+    """Just the string calls the sim cache makes, over a dict, counting round trips."""
+
+    def __init__(self):
+        self.values = {}
+        self.round_trips = 0
+
+    def get(self, key):
+        self.round_trips += 1
+        return self.values.get(key)
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.round_trips += 1
+        self.values[key] = value
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Pipeline:
+
+    def __init__(self, r):
+        self.r = r
+        self.queued = []
+
+    def set(self, key, value):
+        self.queued.append((key, value))
+
+    def execute(self):
+        self.r.round_trips += 1
+        self.r.values.update(self.queued)
+        return [True] * len(self.queued)
+
+
+@pytest.fixture
+def sim_cache(monkeypatch):
+    r = KVRedis()
+    monkeypatch.setattr(passage_similarity, 'r', r)
+    return r
+
+
+@pytest.fixture
+def fake_models(monkeypatch, sim_cache):
+    monkeypatch.setattr(passage_similarity, 'encoders', {'use': fake_encode, 'mpnet': fake_encode})
+    monkeypatch.setattr(passage_similarity, 'batch_encoders',
+                        {'use': fake_encode_batch, 'mpnet': fake_encode_batch})
+
+
+def hit(num_lines):
+    return {'_id': 'doc1',
+            '_source': {'first_line': 'How to upgrade vCenter Server',
+                        'remaining_lines': [f"Step {idx}: a long enough line about upgrading hosts"
+                                            for idx in range(num_lines)] + ['too short']}}
+
+
+def looped(query, hit, remaining_lines=True):
+    """The per line loop passage_similarity_long_lines used to run, for one model."""
+    lines = passage_similarity.get_lines(hit)
+    query_encoding = fake_encode(query)
+    max_sim = max_sim5 = max_sim10 = -1.0
+    sum_sim = sum_sim5 = sum_sim10 = 0.0
+    num_lines = 0
+    for idx, line in enumerate(lines):
+        encoding = fake_encode(line)
+        cos_sim = dot(encoding, query_encoding) / (norm(encoding) * norm(query_encoding))
+        sum_sim += cos_sim
+        max_sim = max(max_sim, cos_sim)
+        if idx < 10:
+            sum_sim10 += cos_sim
+            max_sim10 = max(max_sim10, cos_sim)
+        if idx < 5:
+            sum_sim5 += cos_sim
+            max_sim5 = max(max_sim5, cos_sim)
+        if idx == 0:
+            first_line_sim = cos_sim
+        num_lines += 1
+        if not remaining_lines:
+            break
+    return {'first_line_sim': first_line_sim,
+            'max_sim': max_sim, 'max_sim_5': max_sim5, 'max_sim_10': max_sim10,
+            'sum_sim': sum_sim, 'sum_sim_5': sum_sim5, 'sum_sim_10': sum_sim10,
+            'mean_sim': sum_sim / num_lines,
+            'mean_sim_5': sum_sim5 / min(num_lines, 5),
+            'mean_sim_10': sum_sim10 / min(num_lines, 10)}
+
+
+@pytest.mark.parametrize("num_lines,remaining_lines", [(0, True), (3, True), (7, True), (25, True), (25, False)])
+def test_matches_looped(fake_models, num_lines, remaining_lines):
+    query = 'upgrade vcenter'
+    scored = hit(num_lines)
+    passage_similarity_long_lines(query, scored, sim_cache=False, remaining_lines=remaining_lines)
+    expected = looped(query, scored, remaining_lines=remaining_lines)
+    for field in cached_fields():
+        feature = field.rsplit('_', 1)[0]
+        assert scored['_source'][field] == pytest.approx(expected[feature], abs=1e-6)
+
+
+def test_index_time_line_vectors(fake_models, monkeypatch, tmp_path):
+    query = 'upgrade vcenter'
+    scored = hit(12)
+    line_index = MaxSimIndex.write(str(tmp_path / 'lines'), [('doc1', passage_similarity.get_lines(scored))],
+                                   fake_encode_batch, batch_lines=5)
+    monkeypatch.setattr(passage_similarity, '_line_indexes', {'use': line_index, 'mpnet': line_index})
+
+    def no_line_encoding(texts, cached=False):
+        raise AssertionError("Lines should come from the line index")
+    monkeypatch.setattr(passage_similarity, 'batch_encoders',
+                        {'use': no_line_encoding, 'mpnet': no_line_encoding})
+
+    passage_similarity_long_lines(query, scored, sim_cache=False)
+    expected = looped(query, scored)
+    for field in cached_fields():
+        assert scored['_source'][field] == pytest.approx(expected[field.rsplit('_', 1)[0]], abs=1e-6)
+
+
+def test_stale_line_vectors_fall_back_to_encoding(fake_models, monkeypatch, tmp_path):
+    query = 'upgrade vcenter'
+    scored = hit(12)
+    lines = passage_similarity.get_lines(scored)
+    # Same number of lines, one edited since indexing
+    edited = lines[:3] + ['Step 3: an edited line about upgrading hosts'] + lines[4:]
+    line_index = MaxSimIndex.write(str(tmp_path / 'use'), [('doc1', edited)], fake_encode_batch,
+                                   fingerprint='v1')
+    monkeypatch.setattr(passage_similarity, '_line_indexes', {'use': line_index, 'mpnet': None})
+    passage_similarity_long_lines(query, scored, sim_cache=False)
+    expected = looped(query, scored)
+    for field in cached_fields():
+        assert scored['_source'][field] == pytest.approx(expected[field.rsplit('_', 1)[0]], abs=1e-6)
+
+
+def test_line_index_from_other_model_version_ignored(monkeypatch, tmp_path):
+    MaxSimIndex.write(str(tmp_path / 'use'), [('doc1', ['a line'])], fake_encode_batch, fingerprint='v1')
+    monkeypatch.setattr(passage_similarity, 'line_vectors_dir', str(tmp_path))
+    monkeypatch.setattr(passage_similarity, 'fingerprints', {'use': lambda: 'v1'})
+    monkeypatch.setattr(passage_similarity, '_line_indexes', {})
+    assert passage_similarity.line_index('use').fingerprint == 'v1'
+
+    monkeypatch.setattr(passage_similarity, 'fingerprints', {'use': lambda: 'v1:int8'})
+    monkeypatch.setattr(passage_similarity, '_line_indexes', {})
+    assert passage_similarity.line_index('use') is None
+
+
+def test_score_hits_matches_per_hit_and_dedupes_lines(fake_models, monkeypatch):
+    query = 'upgrade vcenter'
+    hits = [hit(num_lines) for num_lines in [0, 3, 12, 12]]
+    for idx, scored in enumerate(hits):
+        scored['_id'] = f"doc{idx}"
+    expected = [{'_id': scored['_id'], '_source': dict(scored['_source'])} for scored in hits]
+    for scored in expected:
+        passage_similarity_long_lines(query, scored, sim_cache=False)
+
+    encoded = []
+
+    def counting_encode_batch(texts, cached=False):
+        encoded.extend(texts)
+        return fake_encode_batch(texts)
+    monkeypatch.setattr(passage_similarity, 'batch_encoders',
+                        {'use': counting_encode_batch, 'mpnet': counting_encode_batch})
+
+    score_hits(query, hits, sim_cache=False)
+    for scored, per_hit in zip(hits, expected):
+        for field in cached_fields():
+            assert scored['_source'][field] == pytest.approx(per_hit['_source'][field], abs=1e-6)
+    # The hits share all their lines, so each distinct line is encoded once per model
+    assert len(encoded) == 2 * 13
+    assert len(set(encoded)) == 13
+
+
+def test_score_hits_only_runs_models_of_features(fake_models, sim_cache):
+    scored = hit(3)
+    score_hits('upgrade vcenter', [scored], features=['max_sim_use'], sim_cache=False)
+    assert 'max_sim_use' in scored['_source']
+    assert 'mean_sim_use' in scored['_source']
+    assert 'max_sim_mpnet' not in scored['_source']
+    assert sim_cache.values == {}
+
+
+def test_score_hits_two_round_trips_and_no_writes_on_hits(fake_models, sim_cache):
+    query = 'upgrade vcenter'
+    hits = [hit(num_lines) for num_lines in [1, 4, 9]]
+    for idx, scored in enumerate(hits):
+        scored['_id'] = f"doc{idx}"
+    score_hits(query, hits[:2])
+    assert sim_cache.round_trips == 2
+    assert len(sim_cache.values) == 2
+
+    sim_cache.round_trips = 0
+    rescored = [{'_id': scored['_id'], '_source': {'first_line': scored['_source']['first_line'],
+                                                   'remaining_lines': scored['_source']['remaining_lines']}}
+                for scored in hits]
+    score_hits(query, rescored)
+    # One lookup for all three, one write for the one miss
+    assert sim_cache.round_trips == 2
+    assert len(sim_cache.values) == 3
+    for scored, cached in zip(hits[:2], rescored[:2]):
+        for field in cached_fields():
+            assert cached['_source'][field] == pytest.approx(scored['_source'][field])
+
+    sim_cache.round_trips = 0
+    score_hits(query, rescored)
+    assert sim_cache.round_trips == 1
+
+
+def test_scoring_context_encodes_query_once_per_model(fake_models, monkeypatch):
+    encoded = []
+
+    def counting_encode(text, cached=False):
+        encoded.append(text)
+        return fake_encode(text)
+    monkeypatch.setattr(passage_similarity, 'encoders', {'use': counting_encode, 'mpnet': counting_encode})
+
+    context = ScoringContext('upgrade vcenter')
+    hits = [hit(3), hit(5)]
+    for scored in hits:
+        passage_similarity_long_lines(context, scored, sim_cache=False)
+    score_hits(context, [hit(7)], sim_cache=False)
+    assert encoded == ['upgrade vcenter', 'upgrade vcenter']
+    assert context.tokens == ['upgrade', 'vcenter']
+    assert context.get('num_tokens', lambda query: len(query.split())) == 2
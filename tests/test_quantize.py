@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from vmware.vector.corpus import quantize
+from vmware.vector.quantize import ScalarQuantizer
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    # Dims with very different ranges, as real embeddings have
+    return (rng.normal(size=(2000, 32)) * np.linspace(0.01, 1.0, 32)).astype(np.float32)
+
+
+def test_round_trip_within_half_a_step(vectors):
+    quantizer = ScalarQuantizer.fit(vectors)
+    codes = quantizer.quantize(vectors, chunk_rows=100)
+    assert codes.dtype == np.uint8
+    error = np.abs(quantizer.dequantize(codes) - vectors)
+    assert (error <= quantizer.scale / 2 + 1e-6).all()
+
+
+def test_quantize_leaves_input_alone(vectors):
+    before = vectors.copy()
+    ScalarQuantizer.fit(vectors).quantize(vectors)
+    assert (vectors == before).all()
+
+
+def test_outliers_clipped(vectors):
+    quantizer = ScalarQuantizer.fit(vectors, clip=0.01)
+    codes = quantizer.quantize(vectors * 10)
+    assert codes.min() == 0
+    assert codes.max() == 255
+
+
+def test_report(vectors):
+    report = ScalarQuantizer.fit(vectors).report(vectors, num_queries=20, k=5)
+    assert report['mean_cosine'] > 0.99
+    assert report['recall@5'] > 0.8
+    assert report['float32_bytes_per_vector'] == 4 * report['bytes_per_vector']
+
+
+def test_save_load(tmp_path, vectors):
+    quantizer = ScalarQuantizer.fit(vectors)
+    quantizer.save(str(tmp_path / 'quantizer.npz'))
+    loaded = ScalarQuantizer.load(str(tmp_path / 'quantizer.npz'))
+    assert (loaded.quantize(vectors) == quantizer.quantize(vectors)).all()
+
+
+def test_corpus_quantize_does_not_modify():
+    arr = np.array([-1.0, 0.0, 1.0], dtype=np.float32)
+    assert quantize(arr).tolist() == [0, 128, 255]
+    assert arr[2] == 1.0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from vmware.vector.reduce import Reducer, reduced_mapping, tradeoff_report
+from vmware.vector.similarity import similarity
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    # Most variance in a few directions, as real embeddings have
+    basis = np.linalg.qr(rng.normal(size=(64, 64)))[0]
+    weights = rng.normal(size=(1000, 64)) * np.geomspace(1.0, 0.01, 64)
+    return (weights @ basis.T).astype(np.float32)
+
+
+def test_pca_keeps_neighbors_better_than_truncation(vectors):
+    report = {(row['method'], row['dims']): row['recall@10']
+              for row in tradeoff_report(vectors, dims_list=[8, 16], num_queries=50)}
+    assert report[('pca', 16)] > 0.8
+    assert report[('pca', 16)] > report[('truncation', 16)]
+    assert report[('pca', 16)] >= report[('pca', 8)]
+
+
+def test_transform_normalizes_one_or_many(vectors):
+    reducer = Reducer.fit_pca(vectors, 16)
+    many = reducer.transform(vectors[:10])
+    assert many.shape == (10, 16)
+    assert np.allclose(np.linalg.norm(many, axis=1), 1.0, atol=1e-5)
+    assert np.allclose(reducer.transform(vectors[3]), many[3], atol=1e-5)
+
+
+def test_truncation():
+    reducer = Reducer.truncation(2)
+    assert np.allclose(reducer.transform([3.0, 4.0, 100.0]), [0.6, 0.8])
+
+
+def test_save_load(vectors, tmp_path):
+    for reducer in [Reducer.fit_pca(vectors, 8), Reducer.truncation(8)]:
+        reducer.save(tmp_path / 'reducer.npz')
+        loaded = Reducer.load(tmp_path / 'reducer.npz')
+        assert loaded.dims == 8
+        assert np.allclose(loaded.transform(vectors[:5]), reducer.transform(vectors[:5]))
+
+
+def test_reduced_mapping():
+    mapping = {'properties': {'a_vector': {'type': 'dense_vector', 'dims': 768},
+                              'a_text': {'type': 'text'}}}
+    reduced = reduced_mapping(mapping, 128)
+    assert reduced['properties']['a_vector']['dims'] == 128
+    assert reduced['properties']['a_text'] == {'type': 'text'}
+    assert mapping['properties']['a_vector']['dims'] == 768
+
+
+def test_query_time_similarity_in_reduced_space(vectors):
+    import pandas as pd
+    corpus = pd.DataFrame({'vector': list(vectors)})
+    reducer = Reducer.fit_pca(vectors, 32)
+    wrapped = reducer.wrap(lambda text: vectors[int(text)])
+    assert wrapped('7').shape == (32,)
+    top = similarity('7', lambda text: vectors[int(text)], corpus, 'vector', n=1, reducer=reducer)
+    assert top.index[0] == 7
+
+
+def test_fit_on_quantized_codes_applies_to_floats(vectors):
+    from vmware.vector.corpus import quantize
+    floats = vectors / np.abs(vectors).max()
+    from_codes = Reducer.fit_pca(quantize(floats), 16)
+    from_floats = Reducer.fit_pca(floats, 16)
+    # A reducer fit on raw codes (mean ~127) maps every float vector to about the same direction
+    reduced = from_codes.transform(floats[:100])
+    cosines = reduced @ reduced.T
+    assert cosines.min() < 0.5
+    assert np.allclose(from_codes.mean, from_floats.mean, atol=0.01)
+    report = tradeoff_report(quantize(floats), dims_list=[16], methods=['pca'], num_queries=50)
+    assert report[0]['recall@10'] > 0.8
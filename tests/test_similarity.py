@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from vmware.vector.corpus import quantize
+from vmware.vector.similarity import ExactIndex, exact_nearest_neighbors, similarity
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(1000, 16)).astype(np.float32)
+
+
+def brute_force(query, vectors, n):
+    cos = (vectors @ query) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+    return np.argsort(-cos)[:n], np.sort(cos)[::-1][:n]
+
+
+def test_exact_matches_brute_force(vectors):
+    query = vectors[10] + 0.1
+    idx, scores = ExactIndex(vectors).search(query, n=10)
+    expected_idx, expected_scores = brute_force(query, vectors, 10)
+    assert idx.tolist() == expected_idx.tolist()
+    assert scores == pytest.approx(expected_scores, abs=1e-5)
+
+
+def test_exact_blocked_same_as_unblocked(vectors):
+    queries = vectors[:5] + 0.1
+    tiny_budget = ExactIndex(vectors, memory_budget=4096)
+    assert tiny_budget._block_rows(len(queries)) < len(vectors)
+    idx, scores = tiny_budget.search(queries, n=7)
+    expected_idx, expected_scores = ExactIndex(vectors).search(queries, n=7)
+    assert idx.shape == (5, 7)
+    assert (idx == expected_idx).all()
+    assert scores == pytest.approx(expected_scores, abs=1e-5)
+
+
+def test_exact_uint8_close_to_float(vectors):
+    unit = vectors / np.abs(vectors).max()
+    quantized = quantize(unit.copy())
+    idx, _ = ExactIndex(quantized).search(quantize(unit[3].copy()), n=1)
+    assert idx[0] == 3
+
+
+def test_exact_n_larger_than_corpus(vectors):
+    idx, scores = ExactIndex(vectors[:3]).search(vectors[0], n=10)
+    assert len(idx) == 3
+    assert idx[0] == 0
+
+
+def test_exact_nearest_neighbors(vectors):
+    idx, scores = exact_nearest_neighbors(vectors[42], vectors, n=1)
+    assert idx[0] == 42
+    assert scores[0] == pytest.approx(1.0)
+
+
+def test_similarity_sorted_dataframe(vectors):
+    corpus = pd.DataFrame({'passage': [str(i) for i in range(len(vectors))],
+                           'vector': list(vectors)})
+    top = similarity('42', lambda q: vectors[int(q)], corpus, 'vector', n=3)
+    assert top['passage'].iloc[0] == '42'
+    assert top['scores'].is_monotonic_decreasing
@@ -0,0 +1,55 @@
+import numpy as np
+from vmware.vector.model_encoder import ModelEncoder
+from vmware.vector.stats import Histogram, Stats
+
+
+class FakeModel:
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return np.full(4, len(texts), dtype=np.float32)
+        return np.array([np.full(4, len(text)) for text in texts], dtype=np.float32)
+
+
+def test_histogram_quantiles_within_2x():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    summary = histogram.summary()
+    assert summary['count'] == 1000
+    assert summary['mean'] == 500.5
+    assert 500 <= summary['p50'] <= 1000
+    assert 990 <= summary['p99'] <= 1000
+    assert summary['max'] == 1000
+
+
+def test_stats_reset():
+    stats = Stats()
+    stats.incr('hits', 3)
+    with stats.timer('get_us'):
+        pass
+    snapshot = stats.snapshot()
+    assert snapshot['hits'] == 3
+    assert snapshot['get_us']['count'] == 1
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_encoder_stats(tmp_path):
+    encoder = ModelEncoder('fake', dims=4, fingerprint='abc', cache_dir=str(tmp_path))
+    encoder._model = FakeModel()
+    encoder.encode_batch(['a', 'bb', 'bb'], cached=True)
+    encoder.encode_batch(['a', 'ccc'], cached=True)
+
+    stats = encoder.stats()
+    assert stats['texts'] == 5
+    assert stats['cache_hits'] == 1
+    assert stats['cache_misses'] == 4
+    assert stats['cache_hit_rate'] == 0.2
+    assert stats['batch_size']['count'] == 2
+    assert stats['cache']['namespace']['keys'] == 3
+    assert stats['cache']['get_many_keys']['max'] == 3
+
+    encoder.reset_stats()
+    assert encoder.stats()['cache_hit_rate'] == 0.0
+    assert 'hits' not in encoder.stats()['cache']
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+from vmware.vector.vector_cache import LRUVectorCache, NullVectorCache, VectorCache, to_storage, from_storage
+
+
+@pytest.fixture
+def lru():
+    # Room for two 4 dim float32 vectors
+    return LRUVectorCache(NullVectorCache(dims=4, dtype=np.float32), max_bytes=32)
+
+
+def vec(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_lru_hit_after_set(lru):
+    lru.set('a', vec(1.0))
+    assert (lru.get('a') == vec(1.0)).all()
+    assert lru.stats()['local']['hits'] == 1
+
+
+def test_lru_evicts_least_recently_used(lru):
+    lru.set('a', vec(1.0))
+    lru.set('b', vec(2.0))
+    lru.get('a')
+    lru.set('c', vec(3.0))
+
+    assert lru.get('b') is None
+    assert lru.get('a') is not None
+    assert lru.get('c') is not None
+    stats = lru.stats()
+    assert stats['local']['evictions'] == 1
+    assert stats['local']['bytes'] <= 32
+
+
+def test_lru_get_many_reports_misses(lru):
+    lru.set_many(['a', 'b'], np.stack([vec(1.0), vec(2.0)]))
+    vectors, missed = lru.get_many(['b', 'x', 'a'])
+    assert missed == [1]
+    assert (vectors[0] == vec(2.0)).all()
+    assert (vectors[2] == vec(1.0)).all()
+    assert lru.stats()['remote']['misses'] == 1
+
+
+def test_lru_cached_vectors_are_read_only(lru):
+    lru.set('a', vec(1.0))
+    with pytest.raises(ValueError):
+        lru.get('a')[0] = 5.0
+
+
+def test_f16_storage_keeps_cosines():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 768)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    stored = to_storage(vectors, np.float16)
+    assert stored.nbytes == vectors.nbytes // 2
+
+    decoded = np.empty_like(vectors)
+    for row, value in zip(decoded, stored):
+        from_storage(value.tobytes(), row, np.float16)
+    assert decoded.dtype == np.float32
+    assert ((vectors * decoded).sum(axis=1) > 0.9999).all()
+
+    # Cosines between different vectors move by much less than they differ
+    exact = vectors[:20] @ vectors.T
+    approx = decoded[:20] @ decoded.T
+    assert np.abs(exact - approx).max() < 1e-3
+
+
+def test_f16_storage_in_own_namespace():
+    cache = VectorCache(None, 'model', dims=4, dtype=np.float32, fingerprint='abc', storage='f16')
+    assert cache.prefix == 'model:abc:f16'
+    assert cache.row_bytes == 8
+    vectors, missed = cache._decode_rows([to_storage(np.full(4, 0.5), np.float16).tobytes(), None])
+    assert vectors.dtype == np.float32
+    assert (vectors[0] == 0.5).all()
+    assert missed == [1]
+    with pytest.raises(ValueError):
+        VectorCache(None, 'model', dims=4, dtype=np.float32, storage='f8')
+
+
+def test_lru_counters_exact_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = LRUVectorCache(NullVectorCache(dims=4, dtype=np.float32), max_bytes=32)
+
+    def lookups(thread):
+        for idx in range(500):
+            cache.get_many([f"{thread}-{idx}", f"{thread}-{idx}-b"])
+            cache.get(f"{thread}-{idx}-c")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lookups, range(8)))
+    stats = cache.stats()
+    assert stats['remote'] == {'hits': 0, 'misses': 8 * 500 * 3}
+    assert stats['local']['misses'] == 8 * 500 * 3
+
+
+class ScanRedis:
+    """Just SCAN and UNLINK over a dict of keys."""
+
+    def __init__(self, keys):
+        self.data = dict.fromkeys(keys, b'')
+
+    def scan_iter(self, match, count=None):
+        prefix = match.rstrip('*')
+        return [key.encode('utf-8') for key in list(self.data) if key.startswith(prefix)]
+
+    def unlink(self, *keys):
+        for key in keys:
+            del self.data[key]
+
+
+def test_compact_keeps_every_backend_of_current_fingerprint():
+    from vmware.vector.model_encoder import ModelEncoder
+    from vmware.vector.vector_cache import drop_namespace, key_prefix
+    int8 = ModelEncoder('mpnet', dims=4, fingerprint='abc', backend='int8')
+    current = [f"{key_prefix('mpnet', 'abc')}:{'0' * 32}",
+               f"{key_prefix('mpnet', int8.fingerprint)}:{'1' * 32}",
+               f"{key_prefix('mpnet', int8.fingerprint, 'f16')}:{'2' * 32}"]
+    old = [f"mpnet:old:{'3' * 32}", f"mpnet:old:int8:{'4' * 32}"]
+    r = ScanRedis(current + old)
+    assert drop_namespace(r, 'mpnet', keep='abc') == 2
+    assert sorted(r.data) == sorted(current)
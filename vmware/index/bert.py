@@ -36,6 +36,8 @@ import tensorflow as tf
 import pandas as pd
 import tensorflow_hub as hub
 import tensorflow_text as text  # Imports TF ops for preprocessing.
+from functools import partial
+from vmware.vector.reduce import reduced_mapping
 
 BERT_MODEL = "https://tfhub.dev/google/experts/bert/wiki_books/2"
 PREPROCESS_MODEL = "https://tfhub.dev/tensorflow/bert_en_uncased_preprocess/3"
@@ -127,16 +129,23 @@ def sentences_embedding(sentences):
     embeddings = _bert(inputs)['pooled_output']
     return embeddings.numpy().tolist()
 
-def _process_bert_remaining_lines(doc_source):
+def _reduced_embedding(sentences, reducer=None):
+    if reducer is None:
+        return sentences_embedding(sentences)
+    return reducer.transform(sentences_embedding(sentences)).tolist()
+
+
+def _process_bert_remaining_lines(doc_source, reducer=None):
     """Process USE data on long passages and the first line."""
-    doc_source["first_line_bert"] = sentences_embedding([doc_source["first_line"]])[0]
-    assert len(doc_source["first_line_bert"]) == 768
+    dims = 768 if reducer is None else reducer.dims
+    doc_source["first_line_bert"] = _reduced_embedding([doc_source["first_line"]], reducer)[0]
+    assert len(doc_source["first_line_bert"]) == dims
     long_remaining_lines = [line for line in doc_source['remaining_lines'] if len(line) > 20][:10]
-    remaining_lines = sentences_embedding(long_remaining_lines)
+    remaining_lines = _reduced_embedding(long_remaining_lines, reducer)
     for idx, line in enumerate(remaining_lines):
         if idx < 10:
             doc_source[f"long_remaining_lines_bert_{idx}"] = line
-            assert len(doc_source[f"long_remaining_lines_bert_{idx}"]) == 768
+            assert len(doc_source[f"long_remaining_lines_bert_{idx}"]) == dims
     return doc_source
 
 
@@ -163,6 +172,12 @@ def bert_all():
 
 
 
+def reduced(reducer):
+    """(mapping, enrichment) storing reducer projected vectors, see vmware.vector.reduce."""
+    return (reduced_mapping(_bert_mapping, reducer.dims),
+            partial(_process_bert_remaining_lines, reducer=reducer))
+
+
 preprocess = add_sentences
 
 enrichment = _process_bert_remaining_lines
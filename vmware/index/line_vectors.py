@@ -0,0 +1,53 @@
+"""Precompute each doc's normalized line vectors, so reranking only encodes the query.
+
+A sidecar to the Elasticsearch index rather than an enrichment of it: for
+each model, every doc's lines (as get_lines picks them) go into one
+MaxSimIndex under data/line_vectors/{model_name}, which
+passage_similarity_long_lines looks hits up in. Each doc's lines digest and
+the model's fingerprint are kept alongside, so edited docs and changed
+models are encoded at query time rather than scored with stale vectors.
+"""
+import os
+from time import perf_counter
+
+from vmware.vector import use, mpnet
+from vmware.vector.maxsim import MaxSimIndex
+
+
+line_vectors_dir = os.getenv('VMWARE_LINE_VECTORS', 'data/line_vectors')
+
+# model name -> (encode_batch, fingerprint)
+line_encoders = {
+    'use': (use.encode_batch, use.fingerprint),
+    'mpnet': (mpnet.encode_batch, mpnet.fingerprint)
+}
+
+
+def get_lines(hit):
+    """The lines of a doc that are scored: its first line and remaining lines over 20 chars."""
+    lines = [hit['_source']['first_line']]
+    for line in hit['_source']['remaining_lines']:
+        if len(line) > 20:
+            lines.append(line)
+    return lines
+
+
+def doc_lines(es, index='vmware'):
+    """Lazily yield the id and lines of every doc in index."""
+    # Only index builds scan, so only they pay for importing elasticsearch
+    from vmware.vector.corpus import scan_docs
+    for idx, doc in enumerate(scan_docs(es, index, ['id', 'first_line', 'remaining_lines'])):
+        if idx % 10000 == 0:
+            print(f"Scanned {idx}")
+        yield doc['_id'], get_lines(doc)
+
+
+def build(es, index='vmware', out_dir=line_vectors_dir, models=None, batch_lines=4096):
+    """One MaxSimIndex per model, each streaming the corpus' lines from a fresh scan."""
+    for model_name in models or line_encoders:
+        encode_batch, fingerprint = line_encoders[model_name]
+        start = perf_counter()
+        line_index = MaxSimIndex.write(os.path.join(out_dir, model_name), doc_lines(es, index=index),
+                                       encode_batch, batch_lines=batch_lines, fingerprint=fingerprint())
+        print(f"{model_name}: {len(line_index)} docs, {len(line_index.vectors)} lines "
+              f"in {perf_counter() - start:.1f}s")
@@ -1,12 +1,9 @@
-from sentence_transformers import SentenceTransformer
-# import requests_cache
-import requests
-from urllib.parse import urljoin
 import numpy as np
 import re
-
-model_name = 'all-mpnet-base-v2'
-model = SentenceTransformer(model_name)
+from functools import partial
+from vmware.vector.mpnet import model_name, model
+from vmware.vector.encode_server import EncodeClient, DEFAULT_URL
+from vmware.vector.reduce import reduced_mapping
 
 
 _mpnet_mapping = {
@@ -18,25 +15,24 @@ _mpnet_mapping = {
   }
 }
 
-s = requests.Session()
+_clients = {}
 
 
-def _mpnet_passages_server_encode(lines, passages_url='http://192.168.1.47:5001'):
-    encoded_lines = []
-    for line in lines:
-        model_url = urljoin(passages_url, f"encode/{model_name}")
-        resp = s.get(model_url, params={'q': line})
-        if resp.status_code > 300:
-            raise RuntimeError(f"Bad request - {resp.status} - {passages_url}")
-        encoded_lines.append(resp.json()['encoded'])
-    mean = np.mean(np.array(encoded_lines), axis=0)
+def _mpnet_passages_server_encode(lines, passages_url=DEFAULT_URL):
+    """Mean of lines encoded by an encode server (python -m vmware.vector.encode_server), one request per doc."""
+    if passages_url not in _clients:
+        _clients[passages_url] = EncodeClient(passages_url)
+    mean = np.mean(_clients[passages_url].encode(model_name, lines), axis=0)
     assert mean.shape == (768,)
     return mean
 
 
 def _mpnet_encode_lines(lines):
-    encoded = model.encode(lines)
-    return np.mean(encoded)
+    """Mean of lines encoded in process, per dimension."""
+    encoded = model.encode_batch(lines)
+    mean = np.mean(encoded, axis=0)
+    assert mean.shape == (768,)
+    return mean
 
 
 def _mpnet_encode(doc_source, encoder=_mpnet_passages_server_encode):
@@ -54,5 +50,11 @@ def _mpnet_encode(doc_source, encoder=_mpnet_passages_server_encode):
     return doc_source
 
 
+def reduced(reducer, encoder=_mpnet_passages_server_encode):
+    """(mapping, enrichment) storing the reducer projected mean, see vmware.vector.reduce."""
+    return (reduced_mapping(_mpnet_mapping, reducer.dims),
+            partial(_mpnet_encode, encoder=reducer.wrap(encoder)))
+
+
 mapping = _mpnet_mapping
 enrichment = _mpnet_encode
@@ -1,5 +1,7 @@
 """Add USE for entire raw text to vmware corpus."""
+from functools import partial
 from vmware.vector.use import encode
+from vmware.vector.reduce import reduced_mapping
 
 
 _use_mapping = {
@@ -52,7 +54,7 @@ _use_mapping = {
 }
 
 
-def _process_use_remaining_lines(doc_source):
+def _process_use_remaining_lines(doc_source, encode=encode):
     """Process USE data on long passages and the first line."""
     doc_source["first_line_use"] = encode(doc_source["first_line"]).tolist()
     long_remaining_lines = [line for line in doc_source['remaining_lines'] if len(line) > 20]
@@ -62,5 +64,11 @@ def _process_use_remaining_lines(doc_source):
     return doc_source
 
 
+def reduced(reducer):
+    """(mapping, enrichment) storing reducer projected vectors, see vmware.vector.reduce."""
+    return (reduced_mapping(_use_mapping, reducer.dims),
+            partial(_process_use_remaining_lines, encode=reducer.wrap(encode)))
+
+
 mapping = _use_mapping
 enrichment = _process_use_remaining_lines
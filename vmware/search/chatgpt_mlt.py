@@ -2,7 +2,7 @@ import json
 from collections import defaultdict
 from operator import itemgetter
 
-from .passage_similarity import passage_similarity_long_lines
+from .passage_similarity import score_hits
 from .splainer import splainer_url
 
 
@@ -248,8 +248,7 @@ def chatgpt_mlt(es, query, params=None):
     for hit in hits:
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
-    for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
+    score_hits(query, hits)
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
     hits = hits[:10]
     return hits
@@ -1,4 +1,4 @@
-from .passage_similarity import passage_similarity_long_lines
+from .passage_similarity import passage_similarity_long_lines, score_hits, ScoringContext
 from .splainer import splainer_url
 from .query_cache import MemoizeQuery
 # from time import perf_counter
@@ -62,9 +62,10 @@ def with_best_compounds_at_50_plus_10_times_use(es, query, params=None, rerank=T
         }
     }
 
-    new_query = to_compound_query(query, to_decompound, to_compound)
+    context = ScoringContext(query)
+    new_query = to_compound_query(context.tokens, to_decompound, to_compound)
 
-    if new_query != query.split():
+    if new_query != context.tokens:
         new_query = " ".join(new_query)
         alt_clauses = \
                 [{'match_phrase': {   # noqa: E127
@@ -87,7 +88,7 @@ def with_best_compounds_at_50_plus_10_times_use(es, query, params=None, rerank=T
 
     for hit in hits:
         hit['_source']['splainer'] = splainer_url(es_body=body)
-        passage_similarity_long_lines(query, hit, verbose=False)
+    score_hits(context, hits)
 
     if rerank:
         hits = sorted(hits, key=lambda x:
@@ -150,9 +151,10 @@ def with_best_compounds_at_5_only_phrase_search(es, query, params={}):
         }
     }
 
-    new_query = to_compound_query(query, to_decompound, to_compound)
+    context = ScoringContext(query)
+    new_query = to_compound_query(context.tokens, to_decompound, to_compound)
 
-    if new_query != query.split():
+    if new_query != context.tokens:
         new_query = " ".join(new_query)
         alt_clauses = \
                 [{'match_phrase': {   # noqa: E127
@@ -173,7 +175,7 @@ def with_best_compounds_at_5_only_phrase_search(es, query, params={}):
 
     for hit in hits:
         hit['_source']['splainer'] = splainer_url(es_body=body)
-        passage_similarity_long_lines(query, hit, verbose=False)
+    score_hits(context, hits)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
     hits = hits[:5]
@@ -285,9 +287,10 @@ def with_best_query_and_corpus_compounds_at_5_only_phrase_search(es, query, rera
         }
     }
 
-    new_query = to_compound_query(query, to_decompound, to_compound)
+    context = ScoringContext(query)
+    new_query = to_compound_query(context.tokens, to_decompound, to_compound)
 
-    if new_query != query.split():
+    if new_query != context.tokens:
         new_query = " ".join(new_query)
         alt_clauses = \
                 [{'match_phrase': {   # noqa: E127
@@ -308,7 +311,7 @@ def with_best_query_and_corpus_compounds_at_5_only_phrase_search(es, query, rera
 
     for hit in hits:
         hit['_source']['splainer'] = splainer_url(es_body=body)
-        passage_similarity_long_lines(query, hit, verbose=False)
+    score_hits(context, hits)
 
     if rerank:
         hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
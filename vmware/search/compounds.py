@@ -53,10 +53,12 @@ def get_most_freq_corpus_compound_dicts():
 
 
 def to_compound_query(query, to_decompound, to_compound):
+    """Terms of query (a string, or its already split tokens) with compounds joined / split."""
+    tokens = query.split() if isinstance(query, str) else query
     new_query = []
     last_term = ''
     fast_forward = False
-    for first_term, second_term in zip(query.split(), query.split()[1:]):
+    for first_term, second_term in zip(tokens, tokens[1:]):
         last_term = second_term
         if fast_forward:
             print("Skipping: " + first_term + " " + second_term)
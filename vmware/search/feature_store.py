@@ -0,0 +1,229 @@
+"""Query-doc feature rows, packed float32, columnar offline and in Redis online.
+
+FeatureStore holds one row of features per (query, doc) pair, with queries
+and doc ids (as strings, like ES _ids) interned to int ids, as three arrays: query ids, doc ids and an
+(n, num_features) float32 matrix. Offline jobs save / load it whole as npz
+or Parquet.
+
+RedisFeatureStore is the online side for point lookups: each pair's row is
+one packed float32 string under '{namespace}:{schema}:{query}|||{doc_id}',
+so many pairs are one MGET. schema is a digest of the field names in order,
+so rows written with other fields read as misses rather than as the wrong
+features. Keys hold the query text, so export() can rebuild a FeatureStore
+from Redis.
+"""
+import hashlib
+import os
+import numpy as np
+
+
+class FeatureStore:
+
+    def __init__(self, fields, queries=(), docs=(), query_ids=None, doc_ids=None, values=None):
+        self.fields = list(fields)
+        self.queries = list(queries)
+        self.docs = list(docs)
+        self.query_index = {query: idx for idx, query in enumerate(self.queries)}
+        self.doc_index = {doc_id: idx for idx, doc_id in enumerate(self.docs)}
+        self.query_ids = np.empty(1024, dtype=np.int32) if query_ids is None else np.array(query_ids, dtype=np.int32)
+        self.doc_ids = np.empty(1024, dtype=np.int32) if doc_ids is None else np.array(doc_ids, dtype=np.int32)
+        self.values = np.empty((1024, len(self.fields)), dtype=np.float32) if values is None \
+            else np.array(values, dtype=np.float32)
+        self.num_rows = 0 if query_ids is None else len(self.query_ids)
+        self.rows = {(query_id, doc_id): row for row, (query_id, doc_id)
+                     in enumerate(zip(self.query_ids[:self.num_rows].tolist(),
+                                      self.doc_ids[:self.num_rows].tolist()))}
+
+    def __len__(self):
+        return self.num_rows
+
+    def _intern(self, index, values, value):
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    def _grow(self, num_rows):
+        if num_rows <= len(self.values):
+            return
+        capacity = max(num_rows, 2 * len(self.values))
+        for name in ['query_ids', 'doc_ids', 'values']:
+            grown = np.empty((capacity,) + getattr(self, name).shape[1:], dtype=getattr(self, name).dtype)
+            grown[:self.num_rows] = getattr(self, name)[:self.num_rows]
+            setattr(self, name, grown)
+
+    def put_many(self, queries, doc_ids, values):
+        """Set the features of each (queries[i], doc_ids[i]) pair to row i of values."""
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape != (len(queries), len(self.fields)):
+            raise ValueError(f"Expected a ({len(queries)}, {len(self.fields)}) matrix, not {values.shape}")
+        self._grow(self.num_rows + len(queries))
+        for query, doc_id, row_values in zip(queries, doc_ids, values):
+            key = (self._intern(self.query_index, self.queries, query),
+                   self._intern(self.doc_index, self.docs, str(doc_id)))
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = self.num_rows
+                self.query_ids[row], self.doc_ids[row] = key
+                self.num_rows += 1
+            self.values[row] = row_values
+
+    def put(self, query, doc_id, values):
+        self.put_many([query], [doc_id], [values])
+
+    def get_many(self, queries, doc_ids):
+        """(n, num_features) features of each pair, and the indices of pairs not stored (left as nan)."""
+        values = np.full((len(queries), len(self.fields)), np.nan, dtype=np.float32)
+        missed = []
+        for idx, (query, doc_id) in enumerate(zip(queries, doc_ids)):
+            row = self.rows.get((self.query_index.get(query), self.doc_index.get(str(doc_id))))
+            if row is None:
+                missed.append(idx)
+            else:
+                values[idx] = self.values[row]
+        return values, missed
+
+    def get(self, query, doc_id):
+        values, missed = self.get_many([query], [doc_id])
+        return None if missed else values[0]
+
+    def to_dataframe(self):
+        """One row per pair, with Query, DocumentId and a column per feature."""
+        import pandas as pd
+        df = pd.DataFrame(self.values[:self.num_rows], columns=self.fields)
+        df.insert(0, 'DocumentId', np.array(self.docs, dtype=object)[self.doc_ids[:self.num_rows]])
+        df.insert(0, 'Query', np.array(self.queries, dtype=object)[self.query_ids[:self.num_rows]])
+        return df
+
+    @staticmethod
+    def from_dataframe(df, fields):
+        store = FeatureStore(fields)
+        store.put_many(df['Query'].tolist(), df['DocumentId'].tolist(), df[fields].to_numpy())
+        return store
+
+    def save(self, path):
+        """npz, or Parquet if path ends in .parquet."""
+        if path.endswith('.parquet'):
+            self.to_dataframe().to_parquet(path, index=False)
+            return
+        np.savez(path, fields=np.array(self.fields), queries=np.array(self.queries, dtype=str),
+                 docs=np.array(self.docs, dtype=str),
+                 query_ids=self.query_ids[:self.num_rows], doc_ids=self.doc_ids[:self.num_rows],
+                 values=self.values[:self.num_rows])
+
+    @staticmethod
+    def load(path):
+        if path.endswith('.parquet'):
+            import pandas as pd
+            df = pd.read_parquet(path)
+            return FeatureStore.from_dataframe(df, [column for column in df.columns
+                                                    if column not in ['Query', 'DocumentId']])
+        saved = np.load(path if os.path.exists(path) else f"{path}.npz")
+        return FeatureStore(saved['fields'].tolist(), saved['queries'].tolist(), saved['docs'].tolist(),
+                            saved['query_ids'], saved['doc_ids'], saved['values'])
+
+
+class RedisFeatureStore:
+
+    def __init__(self, r, fields, namespace='simf'):
+        self.r = r
+        self.fields = list(fields)
+        self.namespace = namespace
+        self.schema = hashlib.blake2b(','.join(self.fields).encode('utf-8'), digest_size=4).hexdigest()
+        self.prefix = f"{namespace}:{self.schema}:"
+        self.row_bytes = 4 * len(self.fields)
+
+    def key(self, query, doc_id):
+        """Redis key of the pair's row."""
+        return f"{self.prefix}{query}|||{doc_id}"
+
+    def _decode(self, encoded, out):
+        if encoded is None or len(encoded) != self.row_bytes:
+            return False
+        out[:] = np.frombuffer(encoded, dtype=np.float32)
+        return True
+
+    def get_many(self, queries, doc_ids):
+        """(n, num_features) features of each pair in one MGET, and the indices that missed (left as nan)."""
+        values = np.full((len(queries), len(self.fields)), np.nan, dtype=np.float32)
+        if len(queries) == 0:
+            return values, []
+        encoded = self.r.mget([self.key(query, doc_id) for query, doc_id in zip(queries, doc_ids)])
+        missed = [idx for idx, row in enumerate(encoded) if not self._decode(row, values[idx])]
+        return values, missed
+
+    def get(self, query, doc_id):
+        values = np.empty(len(self.fields), dtype=np.float32)
+        return values if self._decode(self.r.get(self.key(query, doc_id)), values) else None
+
+    def set_many(self, queries, doc_ids, values):
+        """Write each pair's row, one pipelined round trip."""
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        pipe = self.r.pipeline(transaction=False)
+        for query, doc_id, row_values in zip(queries, doc_ids, values):
+            pipe.set(self.key(query, doc_id), row_values.tobytes())
+        pipe.execute()
+
+    def set(self, query, doc_id, values):
+        self.set_many([query], [doc_id], [values])
+
+    def load(self, store: FeatureStore, batch_size=10000):
+        """Bulk import an offline store's rows, ie to warm a new Redis."""
+        df = store.to_dataframe()
+        for start in range(0, len(df), batch_size):
+            batch = df.iloc[start:start + batch_size]
+            self.set_many(batch['Query'].tolist(), batch['DocumentId'].tolist(),
+                          batch[self.fields].to_numpy())
+
+    def export(self, count=1000):
+        """Every stored row as a FeatureStore, read with SCAN + MGET batches."""
+        store = FeatureStore(self.fields)
+        prefix = self.prefix
+        batch = []
+
+        def add(keys):
+            queries, doc_ids = zip(*(key[len(prefix):].rsplit('|||', 1) for key in keys))
+            values, missed = self.get_many(queries, doc_ids)
+            found = np.setdiff1d(np.arange(len(keys)), missed)
+            store.put_many([queries[idx] for idx in found], [doc_ids[idx] for idx in found], values[found])
+
+        for key in self.r.scan_iter(match=f"{prefix}*", count=count):
+            batch.append(key.decode('utf-8') if isinstance(key, bytes) else key)
+            if len(batch) >= count:
+                add(batch)
+                batch = []
+        if len(batch) > 0:
+            add(batch)
+        return store
+
+
+def import_hashes(r, store: RedisFeatureStore, namespace='sim', count=1000):
+    """Copy rows cached the old way - a hash of decimal strings per pair under
+    '{namespace}:{query}|||{doc_id}' - into store. Returns how many were complete and copied."""
+    prefix = f"{namespace}:"
+    copied = 0
+
+    def copy(keys):
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, store.fields)
+        pairs, rows = [], []
+        for key, sims in zip(keys, pipe.execute()):
+            if any(sim is None for sim in sims):
+                continue
+            pairs.append(key[len(prefix):].rsplit('|||', 1))
+            rows.append([float(sim) for sim in sims])
+        if len(rows) > 0:
+            queries, doc_ids = zip(*pairs)
+            store.set_many(queries, doc_ids, rows)
+        return len(rows)
+
+    batch = []
+    for key in r.scan_iter(match=f"{prefix}*", count=count, _type='hash'):
+        batch.append(key.decode('utf-8') if isinstance(key, bytes) else key)
+        if len(batch) >= count:
+            copied += copy(batch)
+            batch = []
+    if len(batch) > 0:
+        copied += copy(batch)
+    return copied
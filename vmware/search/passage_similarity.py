@@ -1,20 +1,62 @@
-from numpy import dot
+import os
+import numpy as np
 import redis
 from time import perf_counter
-from numpy.linalg import norm
-from vmware.vector.use import encode as encode_use
-from vmware.vector.mpnet import encode as encode_mpnet
+from vmware.vector.maxsim import MaxSimIndex, normalize_rows, segment_features
+from vmware.vector.use import encode as encode_use, encode_batch as encode_batch_use, warmup as warmup_use, \
+    fingerprint as fingerprint_use
+from vmware.vector.mpnet import encode as encode_mpnet, encode_batch as encode_batch_mpnet, \
+    warmup as warmup_mpnet, fingerprint as fingerprint_mpnet
+from vmware.index.line_vectors import get_lines, line_vectors_dir
+from vmware.search.feature_store import RedisFeatureStore
 
 
 encoders = {
     'use': encode_use,
     'mpnet': encode_mpnet
 }
-namespace = 'sim'
+# All of a hit's lines at once, as an (n, dims) matrix
+batch_encoders = {
+    'use': encode_batch_use,
+    'mpnet': encode_batch_mpnet
+}
+# Version of each model, to check index time line vectors came from it
+fingerprints = {
+    'use': fingerprint_use,
+    'mpnet': fingerprint_mpnet
+}
+# Each (query, doc)'s cached_fields() as one packed float32 row, see vmware.search.feature_store.
+# Before these, they were hashes of decimal strings under 'sim:', which import_hashes copies over
+namespace = 'simf'
+
+# Line vectors precomputed per doc at index time (see vmware.index.line_vectors),
+# one MaxSimIndex per model under line_vectors_dir
+_line_indexes = {}
 
 
 # doc_sims_cache = {}
-r = redis.Redis(host='localhost', port=6399)
+r = redis.Redis.from_url(os.getenv('VMWARE_SIM_CACHE', 'redis://localhost:6399'))
+
+
+def warmup():
+    """Load every encoder's model up front, ie before timing or serving queries."""
+    warmup_use()
+    warmup_mpnet()
+    for model_name in encoders:
+        line_index(model_name)
+
+
+def line_index(model_name):
+    """The model's index time line vectors, or None if they weren't built or came from another model version."""
+    if model_name not in _line_indexes:
+        path = os.path.join(line_vectors_dir, model_name)
+        index = MaxSimIndex.load(path) if os.path.isdir(path) else None
+        if index is not None and index.fingerprint != fingerprints[model_name]():
+            print(f"Ignoring {path}, built with {model_name} {index.fingerprint} "
+                  f"not {fingerprints[model_name]()}, rebuild with scripts/build_line_vectors.py")
+            index = None
+        _line_indexes[model_name] = index
+    return _line_indexes[model_name]
 
 
 def cached_fields():
@@ -33,42 +75,183 @@ def cached_fields():
     return fields
 
 
-def sims_from_cache(cache_key, hit):
-    fields = cached_fields()
+class ScoringContext:
+    """What's derived from one query, computed at most once per (query, strategy call).
 
-    sims = r.hmget(cache_key, fields)
-    if sims is None:
-        return False
+    Strategies create one up front and pass it to score_hits /
+    passage_similarity_long_lines in place of the query string, so the
+    query is encoded once per model however many hits are scored.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = query.split()
+        self.query_vectors = {}
+        self.derived = {}
+
+    def query_vector(self, model_name):
+        """Normalized encoding of the query by the model."""
+        if model_name not in self.query_vectors:
+            self.query_vectors[model_name] = normalize_rows(encoders[model_name](self.query))
+        return self.query_vectors[model_name]
+
+    def get(self, name, derive):
+        """Any other query derived value, derive(query) on first use."""
+        if name not in self.derived:
+            self.derived[name] = derive(self.query)
+        return self.derived[name]
 
-    for field, sim in zip(fields, sims):
-        if sim is None:
-            return False
-        hit['_source'][field] = float(sim)
+
+def scoring_context(query):
+    """query if already a ScoringContext, otherwise a new one for it."""
+    return query if isinstance(query, ScoringContext) else ScoringContext(query)
+
+
+def feature_store():
+    """The sim cache, over the current r."""
+    return RedisFeatureStore(r, cached_fields(), namespace=namespace)
+
+
+def _set_cached(fields, values, hit):
+    for field, value in zip(fields, values.tolist()):
+        hit['_source'][field] = value
+
+
+def sims_from_cache(query, hit):
+    """Set hit's cached features, if cached, in one GET."""
+    store = feature_store()
+    values = store.get(query, hit['_id'])
+    if values is None:
+        return False
+    _set_cached(store.fields, values, hit)
     return True
 
 
-def sims_to_cache(cache_key, hit):
-    fields = cached_fields()
+def sims_to_cache(query, hit):
+    """Cache all hit's features in one SET."""
+    sims_to_cache_many(query, [hit])
+
 
-    for field in fields:
-        r.hset(cache_key, field, float(hit['_source'][field]))
+def sims_from_cache_many(query, hits):
+    """Set each hit's cached features, with one MGET for all of them.
 
+    Returns whether each hit was cached.
+    """
+    store = feature_store()
+    values, missed = store.get_many([query] * len(hits), [hit['_id'] for hit in hits])
+    cached = np.ones(len(hits), dtype=bool)
+    cached[missed] = False
+    for hit, hit_values, hit_cached in zip(hits, values, cached):
+        if hit_cached:
+            _set_cached(store.fields, hit_values, hit)
+    return cached.tolist()
 
-def get_lines(hit):
-    lines = [hit['_source']['first_line']]
-    for line in hit['_source']['remaining_lines']:
-        if len(line) > 20:
-            lines.append(line)
-    return lines
 
+def sims_to_cache_many(query, hits):
+    """Cache all features of every hit in one pipelined round trip."""
+    store = feature_store()
+    store.set_many([query] * len(hits), [hit['_id'] for hit in hits],
+                   [[hit['_source'][field] for field in store.fields] for hit in hits])
 
-def patch_mean(cache_key, hit):
+
+def patch_mean(hit):
+    """Fix up the mean of entries cached back when it held the sum (in memory, the cache is left as is)."""
     lines = get_lines(hit)
     for model_name in encoders:
         if hit['_source'][f'mean_sim_{model_name}'] == hit['_source'][f'sum_sim_{model_name}']:
             hit['_source'][f'mean_sim_{model_name}'] = hit['_source'][f'sum_sim_{model_name}'] / len(lines)
         assert hit['_source'][f'mean_sim_{model_name}'] <= 1.05
-    sims_to_cache(cache_key, hit)
+
+
+def _indexed_lines(index, hit):
+    """Hit's line vectors from the index time line vectors, if there and still current."""
+    if index is None:
+        return None
+    # A doc changed since the index was built falls back to encoding
+    return index.current_lines(hit['_id'], get_lines(hit))
+
+
+def _line_vectors(model_name, hits, hit_lines, vector_cache=False):
+    """Every hit's line vectors back to back, as one matrix.
+
+    Looked up where built at index time, the rest encoded in one batch, each
+    distinct line once - boilerplate lines shared by many KB pages included.
+    """
+    index = line_index(model_name)
+    indexed = [_indexed_lines(index, hit) for hit in hits]
+    to_encode = list(dict.fromkeys(line for lines, line_vectors in zip(hit_lines, indexed)
+                                   if line_vectors is None for line in lines))
+    if len(to_encode) > 0:
+        encoded = batch_encoders[model_name](to_encode, cached=vector_cache)
+        rows = {line: row for row, line in enumerate(to_encode)}
+    parts = []
+    for lines, line_vectors in zip(hit_lines, indexed):
+        if line_vectors is None:
+            parts.append(encoded[[rows[line] for line in lines]])
+        else:
+            parts.append(line_vectors[:len(lines)])
+    return np.concatenate(parts)
+
+
+def hit_sims(context, hits, model_names, remaining_lines=True, vector_cache=False):
+    """Cosine to the query of every line of every hit, back to back, per model, and lines per hit.
+
+    Lines are normalized once and scored with one matmul per model.
+    """
+    hit_lines = [get_lines(hit) for hit in hits]
+    if not remaining_lines:
+        hit_lines = [lines[:1] for lines in hit_lines]
+    sims = {}
+    for model_name in model_names:
+        line_vectors = _line_vectors(model_name, hits, hit_lines, vector_cache=vector_cache)
+        sims[model_name] = normalize_rows(line_vectors) @ context.query_vector(model_name)
+    return sims, [len(lines) for lines in hit_lines]
+
+
+def _set_features(hits, model_name, sims, lengths):
+    """Set max / sum / mean features (see maxsim.segment_features) of the model's sims on each hit."""
+    features = segment_features(sims, lengths)
+    for feature in ['mean_sim', 'mean_sim_5', 'mean_sim_10']:
+        assert (features[feature] <= 1.0).all()
+    for feature, values in features.items():
+        for hit, value in zip(hits, values.tolist()):
+            hit['_source'][f'{feature}_{model_name}'] = value
+
+
+def score_hits(query, hits, features=None, remaining_lines=True, sim_cache=True, vector_cache=False):
+    """Set similarity features on every hit, as passage_similarity_long_lines does one hit at a time.
+
+    query is the query string or its ScoringContext. features are the
+    cached_fields() wanted (default all), only the models they need are
+    run, and every feature of those models is set.
+
+    Cached features of all hits are read in one MGET. The
+    rest are scored together - their lines deduped across hits and encoded
+    once per model - and written back in one more. Returns hits.
+    """
+    context = scoring_context(query)
+    query = context.query
+    fields = cached_fields() if features is None else features
+    model_names = [model_name for model_name in encoders
+                   if any(field.endswith(f"_{model_name}") for field in fields)]
+    to_score = hits
+    if sim_cache:
+        cached = sims_from_cache_many(query, hits)
+        to_score = [hit for hit, hit_cached in zip(hits, cached) if not hit_cached]
+        for hit, hit_cached in zip(hits, cached):
+            if hit_cached:
+                patch_mean(hit)
+    if len(to_score) == 0:
+        return hits
+
+    sims, lengths = hit_sims(context, to_score, model_names,
+                             remaining_lines=remaining_lines, vector_cache=vector_cache)
+    for model_name, model_sims in sims.items():
+        _set_features(to_score, model_name, model_sims, lengths)
+    # The sim cache only holds complete entries
+    if len(model_names) == len(encoders):
+        sims_to_cache_many(query, to_score)
+    return hits
 
 
 def passage_similarity_long_lines(query, hit,
@@ -76,89 +259,40 @@ def passage_similarity_long_lines(query, hit,
                                   remaining_lines=True,
                                   sim_cache=True,
                                   vector_cache=False):
+    """Set similarity features on hit, query being the query string or its ScoringContext."""
     start_time = perf_counter()
-    encode_time = 0.0
-    cache_key = f"{namespace}:{query}|||{hit['_id']}"
-    if sim_cache and sims_from_cache(cache_key, hit):
+    context = scoring_context(query)
+    query = context.query
+    if sim_cache and sims_from_cache(query, hit):
         for field in cached_fields():
             assert field in hit['_source']
         if verbose:
-            print(f"Cached at {cache_key}")
-        patch_mean(cache_key, hit)
+            print(f"Cached at {feature_store().key(query, hit['_id'])}")
+        patch_mean(hit)
         return
 
-    lines = get_lines(hit)
-
-    query_encodings = {model_name: model(query) for model_name, model in encoders.items()}
-
-    max_sims = {model_name: -1.0 for model_name in encoders}
-    max_sims5 = {model_name: -1.0 for model_name in encoders}
-    max_sims10 = {model_name: -1.0 for model_name in encoders}
-    sum_sims = {model_name: 0.0 for model_name in encoders}
-    sum_sims10 = {model_name: 0.0 for model_name in encoders}
-    sum_sims5 = {model_name: 0.0 for model_name in encoders}
-    first_line_sim = {model_name: 0.0 for model_name in encoders}
-
-    num_lines = 0
     if verbose:
         print('----')
         print(query)
-    for idx, line in enumerate(lines):
-        cos_sims = {}
-        for model_name, model in encoders.items():
-            encode_start = perf_counter()
-            encoding = model(line, cached=vector_cache)
-            encode_time += (perf_counter() - encode_start)
-            cos_sims[model_name] = (dot(encoding, query_encodings[model_name]) / (norm(encoding) * norm(query_encodings[model_name])))
-            sum_sims[model_name] = sum_sims[model_name] + cos_sims[model_name]
-            max_sims[model_name] = max(max_sims[model_name], cos_sims[model_name])
-
-            if idx < 10:
-                sum_sims10[model_name] = sum_sims10[model_name] + cos_sims[model_name]
-                max_sims10[model_name] = max(max_sims10[model_name], cos_sims[model_name])
-            if idx < 5:
-                sum_sims5[model_name] = sum_sims5[model_name] + cos_sims[model_name]
-                max_sims5[model_name] = max(max_sims5[model_name], cos_sims[model_name])
-            if idx == 0:
-                first_line_sim[model_name] = cos_sims[model_name]
+    sims, lengths = hit_sims(context, [hit], list(encoders),
+                             remaining_lines=remaining_lines, vector_cache=vector_cache)
+    for model_name, model_sims in sims.items():
+        _set_features([hit], model_name, model_sims, lengths)
 
-        first_key = list(encoders.keys())[0]
-        num_stars = 10 * (cos_sims[first_key] + 1)
-        num_lines += 1
-        if verbose:
-            print(f"{first_key} {cos_sims[first_key]:.2f}", "*" * int(num_stars), " " * (20 - int(num_stars)), line[:40])
-        if not remaining_lines:
-            break
-
-    for model_name, model in encoders.items():
-        mean = sum_sims[model_name] / num_lines
-        mean10 = sum_sims10[model_name] / min(num_lines, 10)
-        mean5 = sum_sims5[model_name] / min(num_lines, 5)
-        assert mean10 <= 1.0
-        assert mean5 <= 1.0
-        assert mean <= 1.0
-        # assert mean != sum_sims[model_name]
-        hit['_source'][f'max_sim_{model_name}'] = max_sims[model_name]
-        hit['_source'][f'sum_sim_{model_name}'] = sum_sims[model_name]
-        hit['_source'][f'mean_sim_{model_name}'] = mean
-
-        hit['_source'][f'max_sim_10_{model_name}'] = max_sims10[model_name]
-        hit['_source'][f'sum_sim_10_{model_name}'] = sum_sims10[model_name]
-        hit['_source'][f'mean_sim_10_{model_name}'] = mean10
-
-        hit['_source'][f'max_sim_5_{model_name}'] = max_sims5[model_name]
-        hit['_source'][f'sum_sim_5_{model_name}'] = sum_sims5[model_name]
-        hit['_source'][f'mean_sim_5_{model_name}'] = mean5
-
-        hit['_source'][f'first_line_sim_{model_name}'] = first_line_sim[model_name]
-
-    sims_to_cache(cache_key, hit)
+    sims_to_cache(query, hit)
     for field in cached_fields():
         assert field in hit['_source']
 
     if verbose:
-        for model_name, model in encoders.items():
-            print(f"{model_name} MAX: {max_sims[model_name]:.2f} | SUM: {sum_sims[model_name]:.2f} | MEAN: {mean:.2f}")
-            print(f"{model_name} MAX10: {max_sims10[model_name]:.2f} | SUM10: {sum_sims10[model_name]:.2f} | MEAN10: {mean10:.2f}")
-        print(f"Took: {perf_counter() - start_time:.2f} | Enc {encode_time:.2f}")
+        first_key = list(encoders.keys())[0]
+        for line, cos_sim in zip(get_lines(hit), sims[first_key]):
+            num_stars = 10 * (cos_sim + 1)
+            print(f"{first_key} {cos_sim:.2f}", "*" * int(num_stars), " " * (20 - int(num_stars)), line[:40])
+        for model_name in encoders:
+            source = hit['_source']
+            print(f"{model_name} MAX: {source[f'max_sim_{model_name}']:.2f} | "
+                  f"SUM: {source[f'sum_sim_{model_name}']:.2f} | MEAN: {source[f'mean_sim_{model_name}']:.2f}")
+            print(f"{model_name} MAX10: {source[f'max_sim_10_{model_name}']:.2f} | "
+                  f"SUM10: {source[f'sum_sim_10_{model_name}']:.2f} | MEAN10: {source[f'mean_sim_10_{model_name}']:.2f}")
+        print(f"Took: {perf_counter() - start_time:.2f}")
         print(f"Cache: sim:{sim_cache} vector_cache:{vector_cache}")
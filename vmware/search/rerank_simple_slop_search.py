@@ -1,5 +1,5 @@
 import json
-from .passage_similarity import passage_similarity_long_lines
+from .passage_similarity import score_hits
 from .splainer import splainer_url
 from .query_cache import MemoizeQuery
 
@@ -40,8 +40,7 @@ def max_passage_rerank_first_remaining_lines(es, query):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
-    for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
+    score_hits(query, hits)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
     hits = hits[:5]
@@ -101,8 +100,8 @@ def rerank_simple_slop_search(es, query, params=None):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
+    score_hits(query, hits)
     for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
@@ -159,8 +158,8 @@ def rerank_simple_slop_search_max_snippet_at_5(es, query):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
+    score_hits(query, hits)
     for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
@@ -208,8 +207,8 @@ def rerank_simple_slop_search_sum_snippets_at_5(es, query):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
+    score_hits(query, hits)
     for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
     hits = sorted(hits, key=lambda x: x['_source']['sum_sim'], reverse=True)
@@ -254,8 +253,8 @@ def rerank_slop_search_max_passage_rerank_at_10(es, query):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
+    score_hits(query, hits)
     for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
@@ -300,8 +299,8 @@ def max_passage_rerank_at_50(es, query):
 
     hits = es.search(index='vmware', body=body)['hits']['hits']
 
+    score_hits(query, hits)
     for hit in hits:
-        passage_similarity_long_lines(query, hit, verbose=False)
         hit['_source']['splainer'] = splainer_url(es_body=body)
 
     hits = sorted(hits, key=lambda x: x['_source']['max_sim_use'], reverse=True)
@@ -12,7 +12,9 @@ import sys
 import os
 # Prepend cwd to sys.path
 sys.path.insert(0, os.getcwd())
-from vmware.search.passage_similarity import passage_similarity_long_lines, cached_fields  # noqa: E402
+from vmware.search.passage_similarity import passage_similarity_long_lines, cached_fields, \
+    feature_store  # noqa: E402
+from vmware.search.feature_store import FeatureStore  # noqa: E402
 
 
 def passage_similarity(es, query, doc_id):
@@ -45,8 +47,32 @@ def sim_worker(es, result):
         return {**result, **sims}
 
 
+def cached_similarity(simulated_results: pd.DataFrame, batch_size: int = 10000):
+    """Split simulated_results into rows with features already in the sim cache (set on them) and the rest.
+
+    Reads the cache in one MGET per batch_size rows, with no ES get or rerank.
+    """
+    store = feature_store()
+    values = np.empty((len(simulated_results), len(store.fields)), dtype=np.float32)
+    missed = []
+    queries = simulated_results['Query'].tolist()
+    doc_ids = simulated_results['DocumentId'].tolist()
+    for start in range(0, len(queries), batch_size):
+        values[start:start + batch_size], batch_missed = store.get_many(queries[start:start + batch_size],
+                                                                        doc_ids[start:start + batch_size])
+        missed.extend(start + idx for idx in batch_missed)
+    is_cached = np.ones(len(simulated_results), dtype=bool)
+    is_cached[missed] = False
+    cached = simulated_results[is_cached].copy()
+    for field, column in zip(store.fields, values[is_cached].T):
+        cached[field] = column.astype(np.float64)
+    return cached, simulated_results[~is_cached]
+
+
 def score_similarity(simulated_results: pd.DataFrame, num_to_score: int = None) -> pd.DataFrame:
-    """Score similarity."""
+    """Score similarity, only reranking the rows not already in the sim cache."""
+    cached, simulated_results = cached_similarity(simulated_results)
+    print(f"{len(cached)} rows cached, {len(simulated_results)} to score")
     new_df = []
     es = Elasticsearch(read_timout=300, timeout=300)
     tasks = []
@@ -64,13 +90,25 @@ def score_similarity(simulated_results: pd.DataFrame, num_to_score: int = None)
     for task in as_completed(tasks):
         new_df.append(task.result())
 
-    new_df = pd.DataFrame(new_df)
+    new_df = pd.concat([cached, pd.DataFrame(new_df)], ignore_index=True)
 
     for field in cached_fields():
         new_df = new_df[~new_df[field].isna()]
     return new_df
 
 
+def save_features(scored_results: pd.DataFrame, path: str):
+    """Write scored rows' features as a FeatureStore (npz, or Parquet if path ends in .parquet)."""
+    FeatureStore.from_dataframe(scored_results, cached_fields()).save(path)
+
+
+def load_features(simulated_results: pd.DataFrame, path: str) -> pd.DataFrame:
+    """simulated_results with the features saved at path, rows without them dropped."""
+    features = FeatureStore.load(path).to_dataframe()
+    simulated_results = simulated_results.assign(DocumentId=simulated_results['DocumentId'].astype(str))
+    return simulated_results.merge(features, on=['Query', 'DocumentId'], how='inner')
+
+
 def assign_features(scored_results: pd.DataFrame) -> pd.DataFrame:
     for field in cached_fields():
         scored_results[f'{field}_1'] = scored_results[field] * scored_results['grade']
@@ -120,3 +158,4 @@ def plot(hist0, hist1):
 if __name__ == "__main__":
     df = pd.read_csv("data/simulated_results.csv")
     new_df = score_similarity(df)
+    save_features(new_df, "data/query_doc_features.npz")
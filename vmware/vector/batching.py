@@ -0,0 +1,64 @@
+"""Length bucketed batching of encoder inputs under a token budget.
+
+A transformer pads every text in a batch to the batch's longest text, so
+batching lines in arrival order (20 characters next to whole paragraphs)
+spends most compute on padding. Sorting texts by token length first puts
+similar lengths together, and capping batch_size * longest at max_tokens
+lets short texts go in big batches and long ones in small batches.
+"""
+import numpy as np
+
+
+def approx_token_length(text):
+    """Rough wordpiece count when no tokenizer is at hand (~4 chars a token, plus CLS / SEP)."""
+    return len(text) // 4 + 2
+
+
+def token_budget_batches(lengths, max_tokens=16384, max_batch=256):
+    """Split text indices into batches, shortest texts first, each padding to at most max_tokens."""
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # Sorted ascending, so the newest text is always the batch's longest
+        padded = (end - start) * max(lengths[order[end - 1]], 1)
+        if end - start > 1 and (padded > max_tokens or end - start > max_batch):
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def arrival_batches(num_texts, batch_size=32):
+    """Fixed size batches in input order, the unbucketed baseline."""
+    order = np.arange(num_texts)
+    return [order[start:start + batch_size] for start in range(0, num_texts, batch_size)]
+
+
+def padding_efficiency(lengths, batches):
+    """Fraction of padded tokens that are real tokens, across batches."""
+    lengths = np.asarray(lengths)
+    real = sum(lengths[batch].sum() for batch in batches)
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches if len(batch) > 0)
+    return real / padded if padded > 0 else 1.0
+
+
+def encode_bucketed(encode, texts, lengths=None, max_tokens=16384, max_batch=256):
+    """Encode texts in length bucketed batches, returning vectors in the original order.
+
+    encode takes a list of texts and returns a (len(texts), dims) matrix.
+    lengths are token lengths of each text (approximated if not given).
+    """
+    if lengths is None:
+        lengths = [approx_token_length(text) for text in texts]
+    lengths = np.asarray(lengths)
+    if len(texts) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    encoded = None
+    for batch in token_budget_batches(lengths, max_tokens=max_tokens, max_batch=max_batch):
+        vectors = encode([texts[idx] for idx in batch])
+        if encoded is None:
+            encoded = np.empty((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+        encoded[batch] = vectors
+    return encoded
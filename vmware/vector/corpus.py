@@ -1,37 +1,46 @@
 import elasticsearch.helpers
+import json
+import os
 import pandas as pd
 import numpy as np
 import multiprocessing as mp
 
 
 def quantize(arr, bits=256):
-    """Scale to 0-255, cast to uint8."""
+    """Scale [-1, 1] to 0-255, cast to uint8. arr itself isn't modified.
+
+    See vmware.vector.quantize.ScalarQuantizer for ranges learned per dim.
+    """
     floor = -1.0
     ceil = 1.0
-    arr[arr == 1.0] = ceil - 0.00001
-    assert not (arr > ceil).any()
-    assert not (arr < floor).any()
+    if arr.min() < floor or arr.max() > ceil:
+        raise ValueError(f"Values must be in [{floor}, {ceil}]")
     flt_per_bucket = (abs(floor) + abs(ceil)) / bits
-    quantized = (arr - floor) // flt_per_bucket
-    assert not (arr >= bits).any()
+    # ceil itself would land one past the last bucket
+    quantized = np.minimum((arr - floor) // flt_per_bucket, bits - 1)
     return quantized.astype(np.uint8)
 
 
-def scan_to_dataframe(es, index='vmware', fields=['first_line'], n=None):
-    if 'id' not in fields:
-        fields.append('id')
+def scan_docs(es, index, fields):
+    """Lazily scroll through every doc of index, with just fields of its _source."""
     search_scroll_body = {
         "query": {
             "match_all": {}
         },
         "_source": fields
     }
+    return elasticsearch.helpers.scan(es, index=index,
+                                      scroll='5m',
+                                      size=200,
+                                      request_timeout=120,
+                                      query=search_scroll_body)
+
+
+def scan_to_dataframe(es, index='vmware', fields=['first_line'], n=None):
+    if 'id' not in fields:
+        fields = fields + ['id']
     docs = []
-    for idx, doc in enumerate(elasticsearch.helpers.scan(es, index=index,
-                                                         scroll='5m',
-                                                         size=200,
-                                                         request_timeout=120,
-                                                         query=search_scroll_body)):
+    for idx, doc in enumerate(scan_docs(es, index, fields)):
         if idx % 100 == 0:
             print(f"Scanned {idx}")
         docs.append(doc['_source'])
@@ -41,6 +50,67 @@ def scan_to_dataframe(es, index='vmware', fields=['first_line'], n=None):
     return pd.DataFrame(docs)
 
 
+def scan_to_parquet(es, path, index='vmware', fields=['first_line'], chunk_size=10000, n=None):
+    """Export fields of every doc as a directory of Parquet files, chunk_size docs each.
+
+    Only the requested fields are kept, one column each, and each chunk is
+    a complete file as soon as it's written - a run stopped part way keeps
+    every finished chunk. Read back with read_parquet_corpus.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if 'id' not in fields:
+        fields = fields + ['id']
+    os.makedirs(path, exist_ok=True)
+    schema = None
+    columns = {field: [] for field in fields}
+    num_parts = 0
+
+    def write_part():
+        nonlocal schema, num_parts
+        if schema is None:
+            # Fields null throughout the first chunk would otherwise be typed null forever
+            schema = pa.RecordBatch.from_pydict(columns).schema
+            for field_idx, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(field_idx, pa.field(field.name, pa.string()))
+        part = pa.Table.from_pydict(columns, schema=schema)
+        part_path = os.path.join(path, f"part-{num_parts:05d}.parquet")
+        pq.write_table(part, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        num_parts += 1
+        for values in columns.values():
+            values.clear()
+
+    num_docs = 0
+    for doc in scan_docs(es, index, fields):
+        for field in fields:
+            columns[field].append(doc['_source'].get(field))
+        num_docs += 1
+        if len(columns['id']) >= chunk_size:
+            write_part()
+            print(f"Exported {num_docs}")
+        if n is not None and num_docs >= n:
+            break
+    if len(columns['id']) > 0:
+        write_part()
+    return num_docs
+
+
+def read_parquet_corpus(path, columns=None):
+    """DataFrame of just the given columns of a scan_to_parquet export, memory mapped."""
+    import pyarrow.parquet as pq
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def iter_parquet_docs(path, columns=None, batch_size=1000):
+    """Lazily yield docs (dicts of columns) from a scan_to_parquet export, ie for encode_passage_shards."""
+    import pyarrow.dataset as ds
+    for batch in ds.dataset(path, format='parquet').to_batches(columns=columns, batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
 def passage_dataframe(corpus, column, encoder):
     expl_column = column + "_passages"
     corpus[expl_column] = corpus[column].str.replace('\r', ' ')
@@ -56,3 +126,109 @@ def passage_dataframe(corpus, column, encoder):
             corpus[expl_column]
         )
     return corpus
+
+
+def doc_passages(text):
+    """Split a document's text into passages, same as passage_dataframe."""
+    if not isinstance(text, str):
+        text = ''
+    return text.replace('\r', ' ').split('\n')
+
+
+def _write_json(path, value):
+    with open(path + '.tmp', 'wt') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+def _save_npy(path, arr):
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.replace(path + '.tmp', path)
+
+
+def encode_passage_shards(docs, column, encode_batch, out_dir,
+                          id_field='id', shard_size=100000, batch_size=256, quantizer=None):
+    """Stream docs' passages through encode_batch into on-disk shards.
+
+    docs is any iterable of dicts (ie scan_to_dataframe rows, or an
+    Elasticsearch scan's sources) in a stable order. Passages are encoded
+    batch_size at a time by encode_batch (texts -> (n, dims) float32, ie
+    ModelEncoder.encode_batch), optionally mapped to uint8 by quantizer.
+
+    Each shard holds whole documents, at least shard_size passages:
+        shard_00000.vectors.npy   (num_passages, dims) vectors
+        shard_00000.offsets.npy   (num_docs + 1,) passages of doc i are offsets[i]:offsets[i + 1]
+        shard_00000.doc_ids.npy   (num_docs,) doc ids
+    manifest.json records finished shards and docs consumed, so a rerun after
+    a crash skips what's already on disk. Memory is bounded by one shard.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    manifest = {'shards': [], 'docs': 0, 'passages': 0}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rt') as f:
+            manifest = json.load(f)
+        print(f"Resuming after {manifest['docs']} docs in {len(manifest['shards'])} shards")
+
+    shard_vectors = []
+    shard_doc_ids = []
+    shard_lengths = []
+    pending = []
+
+    def encode_pending():
+        vectors = encode_batch(pending)
+        if quantizer is not None:
+            vectors = quantizer(vectors)
+        shard_vectors.append(vectors)
+        pending.clear()
+
+    def flush_shard(docs_consumed):
+        if len(pending) > 0:
+            encode_pending()
+        if len(shard_doc_ids) == 0:
+            return
+        name = f"shard_{len(manifest['shards']):05d}"
+        offsets = np.zeros(len(shard_lengths) + 1, dtype=np.int64)
+        np.cumsum(shard_lengths, out=offsets[1:])
+        _save_npy(os.path.join(out_dir, f"{name}.vectors.npy"), np.concatenate(shard_vectors))
+        _save_npy(os.path.join(out_dir, f"{name}.offsets.npy"), offsets)
+        _save_npy(os.path.join(out_dir, f"{name}.doc_ids.npy"), np.array(shard_doc_ids))
+        manifest['shards'].append(name)
+        manifest['docs'] = docs_consumed
+        manifest['passages'] += int(offsets[-1])
+        _write_json(manifest_path, manifest)
+        print(f"Wrote {name} - {manifest['docs']} docs {manifest['passages']} passages")
+        shard_vectors.clear()
+        shard_doc_ids.clear()
+        shard_lengths.clear()
+
+    num_docs = 0
+    shard_passages = 0
+    for doc in docs:
+        num_docs += 1
+        if num_docs <= manifest['docs']:
+            continue
+        passages = doc_passages(doc[column])
+        shard_doc_ids.append(doc[id_field])
+        shard_lengths.append(len(passages))
+        for passage in passages:
+            pending.append(passage)
+            if len(pending) >= batch_size:
+                encode_pending()
+        shard_passages += len(passages)
+        if shard_passages >= shard_size:
+            flush_shard(num_docs)
+            shard_passages = 0
+    flush_shard(num_docs)
+    return manifest
+
+
+def read_passage_shards(out_dir, mmap=True):
+    """Yield (vectors, offsets, doc_ids) of each shard written by encode_passage_shards."""
+    with open(os.path.join(out_dir, 'manifest.json'), 'rt') as f:
+        manifest = json.load(f)
+    for name in manifest['shards']:
+        yield (np.load(os.path.join(out_dir, f"{name}.vectors.npy"), mmap_mode='r' if mmap else None),
+               np.load(os.path.join(out_dir, f"{name}.offsets.npy")),
+               np.load(os.path.join(out_dir, f"{name}.doc_ids.npy")))
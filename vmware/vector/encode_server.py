@@ -0,0 +1,205 @@
+"""Local encoding service that micro-batches concurrent requests.
+
+    python -m vmware.vector.encode_server [port]
+
+POST /encode/<model_name> with {"texts": [...]} encodes every text in one
+request. Requests arriving together are gathered into one model call of up
+to max_batch texts, waiting at most max_wait seconds after the first.
+Responses are JSON {"encoded": [[...], ...]}, or raw float32 rows when the
+client sends 'Accept: application/octet-stream' (as EncodeClient does).
+GET /encode/<model_name>?q=<text> still encodes a single text.
+
+Built on the standard library's ThreadingHTTPServer, one thread per
+connection, with all model calls made from each model's batching thread.
+"""
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import urlparse, parse_qs, urljoin
+
+import numpy as np
+
+from .stats import Stats
+
+
+BINARY = 'application/octet-stream'
+DEFAULT_URL = os.getenv('VMWARE_ENCODE_SERVER', 'http://localhost:5001')
+
+
+class MicroBatcher:
+    """Gathers texts from concurrent submit() calls into batched encode_batch calls.
+
+    metrics counts texts and records a histogram of batch sizes (in texts).
+    """
+
+    def __init__(self, encode_batch, max_batch=64, max_wait=0.005):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.metrics = Stats()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts):
+        """Future of the (len(texts), dims) encoded matrix."""
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future
+
+    def _gather(self):
+        batch = [self.requests.get()]
+        num_texts = len(batch[0][0])
+        deadline = perf_counter() + self.max_wait
+        while num_texts < self.max_batch:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            num_texts += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._gather()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            self.metrics.incr('texts', len(texts))
+            self.metrics.record('batch_size', len(texts))
+            try:
+                encoded = self.encode_batch(texts)
+                # Rows are handed back to requests by position, so a short result would misalign them
+                assert len(encoded) == len(texts), \
+                    f"encode_batch returned {len(encoded)} rows for {len(texts)} texts"
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(encoded[start:start + len(request_texts)])
+                start += len(request_texts)
+
+
+def parse_texts(body):
+    """The list of strings under 'texts' of a JSON request body, else ValueError."""
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError("Request body isn't a JSON object")
+    texts = request.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise ValueError("'texts' isn't a list of strings")
+    return texts
+
+
+def make_server(encoders, host='localhost', port=5001, max_batch=64, max_wait=0.005):
+    """HTTP server encoding with encoders, a dict of model name -> encode_batch function."""
+    batchers = {model_name: MicroBatcher(encode_batch, max_batch=max_batch, max_wait=max_wait)
+                for model_name, encode_batch in encoders.items()}
+
+    class EncodeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'   # keep-alive
+
+        def _batcher(self, path):
+            model_name = path[len('/encode/'):] if path.startswith('/encode/') else None
+            if model_name not in batchers:
+                self._respond(404, {'error': f"No model at {path}"})
+                return None
+            return batchers[model_name]
+
+        def _respond(self, status, body, binary=False):
+            if binary:
+                payload = np.ascontiguousarray(body, dtype=np.float32).tobytes()
+                content_type = BINARY
+            else:
+                payload = json.dumps(body).encode('utf-8')
+                content_type = 'application/json'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            if binary:
+                self.send_header('X-Shape', ','.join(str(dim) for dim in body.shape))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _encode(self, batcher, texts, single=False):
+            try:
+                encoded = batcher.submit(texts).result()
+            except Exception as e:
+                self._respond(500, {'error': str(e)})
+                return
+            if BINARY in self.headers.get('Accept', ''):
+                self._respond(200, encoded, binary=True)
+            elif single:
+                self._respond(200, {'encoded': encoded[0].tolist()})
+            else:
+                self._respond(200, {'encoded': encoded.tolist()})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            batcher = self._batcher(url.path)
+            if batcher is not None:
+                self._encode(batcher, parse_qs(url.query).get('q', ['']), single=True)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            batcher = self._batcher(urlparse(self.path).path)
+            if batcher is None:
+                return
+            try:
+                texts = parse_texts(body)
+            except ValueError:
+                self._respond(400, {'error': 'Expected JSON body {"texts": [...]}'})
+                return
+            self._encode(batcher, texts)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), EncodeHandler)
+    server.daemon_threads = True
+    server.batchers = batchers
+    return server
+
+
+class EncodeClient:
+    """Encodes through an encode server, over one pooled keep-alive session."""
+
+    def __init__(self, url=DEFAULT_URL, pool_size=10, timeout=120):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def encode(self, model_name, texts):
+        """(len(texts), dims) float32 matrix, all texts in one request."""
+        resp = self.session.post(urljoin(self.url, f"encode/{model_name}"),
+                                 data=json.dumps({'texts': list(texts)}),
+                                 headers={'Content-Type': 'application/json', 'Accept': BINARY},
+                                 timeout=self.timeout)
+        if resp.status_code > 300:
+            raise RuntimeError(f"Bad request - {resp.status_code} - {self.url} - {resp.text}")
+        shape = tuple(int(dim) for dim in resp.headers['X-Shape'].split(','))
+        return np.frombuffer(resp.content, dtype=np.float32).reshape(shape)
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from vmware.vector import mpnet
+
+    port = int(argv[1]) if len(argv) > 1 else 5001
+    mpnet.warmup()
+    server = make_server({mpnet.model_name: mpnet.model.encode_batch}, port=port)
+    print(f"Encoding {mpnet.model_name} on port {port}")
+    server.serve_forever()
@@ -0,0 +1,180 @@
+"""Approximate nearest neighbors over passage vectors with IVF + product quantization.
+
+Vectors are normalized, assigned to the nearest of nlist coarse k-means
+centroids (the inverted lists), and the residual from that centroid is
+product quantized into m one byte codes. A query scores only the nprobe
+lists whose centroids are closest, approximating cosine as
+q.centroid + sum over subspaces of a (m, 256) lookup table of q.codeword.
+Raising nprobe trades latency for recall.
+
+Saved as plain .npy files in a directory, loadable memory mapped.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from .quantize import dequantize
+
+
+def _normalize(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+def assign(vectors, centroids, block_rows=65536):
+    """Index of the nearest (L2) centroid to each vector."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assigned = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        # |x - c|^2 without the |x|^2 term, constant per row
+        dists = centroid_norms - 2 * (block @ centroids.T)
+        assigned[start:start + block_rows] = dists.argmin(axis=1)
+    return assigned
+
+
+def kmeans(vectors, k, iters=20, seed=0):
+    """Plain Lloyd's k-means, re-seeding empty clusters from random vectors."""
+    if len(vectors) < k:
+        raise ValueError(f"Need at least {k} vectors to train {k} centroids, got {len(vectors)}")
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assigned = assign(vectors, centroids)
+        counts = np.bincount(assigned, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+
+    def __init__(self, centroids, codebooks, list_offsets, codes, ids):
+        self.centroids = centroids          # (nlist, dims)
+        self.codebooks = codebooks          # (m, 256, dims / m)
+        self.list_offsets = list_offsets    # (nlist + 1,) CSR offsets into codes / ids
+        self.codes = codes                  # (n, m) uint8, grouped by list
+        self.ids = ids                      # (n,) id of each code row
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def m(self):
+        return len(self.codebooks)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def train(vectors, nlist=1024, m=16, sample_size=100000, iters=20, seed=0):
+        """Learn coarse centroids and PQ codebooks from a sample of vectors."""
+        vectors = dequantize(vectors)
+        dims = vectors.shape[1]
+        if dims % m != 0:
+            raise ValueError(f"dims {dims} must be divisible by m {m}")
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > sample_size:
+            sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        sample = _normalize(sample)
+
+        centroids = kmeans(sample, nlist, iters=iters, seed=seed)
+        residuals = sample - centroids[assign(sample, centroids)]
+        sub_dims = dims // m
+        codebooks = np.stack([kmeans(residuals[:, j * sub_dims:(j + 1) * sub_dims], 256,
+                                     iters=iters, seed=seed + j)
+                              for j in range(m)])
+        return IVFPQIndex(centroids, codebooks,
+                          list_offsets=np.zeros(nlist + 1, dtype=np.int64),
+                          codes=np.empty((0, m), dtype=np.uint8),
+                          ids=np.empty(0, dtype=np.int64))
+
+    def encode(self, vectors):
+        """Coarse list and PQ codes of each vector."""
+        vectors = _normalize(dequantize(vectors))
+        lists = assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[lists]
+        sub_dims = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(residuals[:, j * sub_dims:(j + 1) * sub_dims], self.codebooks[j])
+        return lists, codes
+
+    def add(self, vectors, ids=None):
+        """Add vectors (ids default to their position, continuing from len(self))."""
+        if ids is None:
+            ids = np.arange(len(self), len(self) + len(vectors), dtype=np.int64)
+        lists, codes = self.encode(vectors)
+
+        all_lists = np.concatenate([np.repeat(np.arange(self.nlist), np.diff(self.list_offsets)), lists])
+        order = np.argsort(all_lists, kind='stable')
+        self.codes = np.concatenate([self.codes, codes])[order]
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])[order]
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_lists, minlength=self.nlist), out=self.list_offsets[1:])
+
+    def search(self, query_vector, n=100, nprobe=8):
+        """Approximate top n (ids, scores) by cosine, best first."""
+        query = _normalize(dequantize(np.atleast_2d(query_vector)))[0]
+        nprobe = min(nprobe, self.nlist)
+        coarse = self.centroids @ query
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        sub_dims = self.codebooks.shape[2]
+        lookup = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.m, sub_dims))
+        subspaces = np.arange(self.m)
+
+        cand_ids = []
+        cand_scores = []
+        for list_idx in probe:
+            start, end = self.list_offsets[list_idx], self.list_offsets[list_idx + 1]
+            if start == end:
+                continue
+            codes = np.asarray(self.codes[start:end])
+            cand_scores.append(coarse[list_idx] + lookup[subspaces, codes].sum(axis=1))
+            cand_ids.append(self.ids[start:end])
+        if len(cand_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        cand_ids = np.concatenate(cand_ids)
+        cand_scores = np.concatenate(cand_scores)
+        n = min(n, len(cand_ids))
+        top = np.argpartition(-cand_scores, n - 1)[:n]
+        top = top[np.argsort(-cand_scores[top], kind='stable')]
+        return cand_ids[top], cand_scores[top]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ['centroids', 'codebooks', 'list_offsets', 'codes', 'ids']:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'wt') as f:
+            json.dump({'nlist': self.nlist, 'm': self.m, 'size': len(self)}, f)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load a saved index, memory mapping the codes and ids."""
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"),
+                                mmap_mode=mmap_mode if name in ['codes', 'ids'] else None)
+                  for name in ['centroids', 'codebooks', 'list_offsets', 'codes', 'ids']}
+        return IVFPQIndex(**arrays)
+
+
+def train_from_corpus(corpus_path='corpus_mpnet.pkl', column='raw_text_passages_vector',
+                      **kwargs):
+    """Train and fill an index from a passage dataframe (see scripts/corpus_to_dataframe.py).
+
+    Index ids are row positions in the dataframe.
+    """
+    corpus = pd.read_pickle(corpus_path)
+    vectors = np.stack(corpus[column].to_list())
+    index = IVFPQIndex.train(vectors, **kwargs)
+    index.add(vectors)
+    return index
@@ -0,0 +1,195 @@
+"""Late interaction (MaxSim) scoring of documents from their line vectors.
+
+Every document's normalized line vectors live in one flat (num_lines, dims)
+matrix, CSR style, with offsets[i]:offsets[i + 1] the rows of document i.
+Scoring many candidate documents is one matrix product of their rows with
+the query, then segment reductions (np.maximum.reduceat / np.add.reduceat)
+into the same max / sum / mean features passage_similarity computes.
+
+Indexes written from texts (MaxSimIndex.write) also keep a digest of each
+document's lines and the fingerprint of the model that encoded them, so
+readers can tell a row is stale (see current_lines) and encode instead.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+
+
+FEATURES = ['first_line_sim',
+            'max_sim_5', 'max_sim', 'max_sim_10',
+            'sum_sim', 'sum_sim_5', 'sum_sim_10',
+            'mean_sim', 'mean_sim_5', 'mean_sim_10']
+
+
+def normalize_rows(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+def lines_digest(lines):
+    """64 bit digest of a document's line texts, to spot docs edited since they were indexed."""
+    digest = hashlib.blake2b('\n'.join(lines).encode('utf-8'), digest_size=8)
+    return int.from_bytes(digest.digest(), 'little')
+
+
+def segment_features(sims, lengths):
+    """Features of each segment (document) of a flat array of line similarities.
+
+    sims holds the cosine of every line of every document, documents
+    back to back, lengths the number of lines of each (all > 0). The at 5 /
+    at 10 features only look at each document's first 5 / 10 lines.
+    """
+    sims = np.asarray(sims, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    line_pos = np.arange(len(sims)) - np.repeat(starts, lengths)
+
+    features = {'first_line_sim': sims[starts],
+                'max_sim': np.maximum.reduceat(sims, starts),
+                'sum_sim': np.add.reduceat(sims, starts)}
+    features['mean_sim'] = features['sum_sim'] / lengths
+    for at in [5, 10]:
+        within = line_pos < at
+        features[f'max_sim_{at}'] = np.maximum.reduceat(np.where(within, sims, -np.inf), starts)
+        features[f'sum_sim_{at}'] = np.add.reduceat(np.where(within, sims, 0.0), starts)
+        features[f'mean_sim_{at}'] = features[f'sum_sim_{at}'] / np.minimum(lengths, at)
+    return features
+
+
+class MaxSimIndex:
+
+    def __init__(self, vectors, offsets, doc_ids, digests=None, fingerprint=None):
+        self.vectors = vectors      # (num_lines, dims) normalized line vectors
+        self.offsets = offsets      # (num_docs + 1,) rows of doc i are offsets[i]:offsets[i + 1]
+        self.doc_ids = doc_ids      # (num_docs,) id of each doc
+        self.digests = digests      # (num_docs,) uint64 lines_digest of each doc, or None if unknown
+        self.fingerprint = fingerprint  # of the model the vectors came from, or None if unknown
+        self.positions = {doc_id: pos for pos, doc_id in enumerate(doc_ids.tolist())}
+
+    @staticmethod
+    def build(doc_ids, line_vectors):
+        """Build from each document's (num_lines, dims) line vectors."""
+        lengths = np.array([len(lines) for lines in line_vectors], dtype=np.int64)
+        if (lengths == 0).any():
+            raise ValueError("Every document needs at least one line")
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return MaxSimIndex(normalize_rows(np.concatenate(line_vectors)),
+                           offsets, np.array(doc_ids))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.positions
+
+    def lines(self, doc_id):
+        """Normalized line vectors of one doc (a view)."""
+        pos = self.positions[doc_id]
+        return self.vectors[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def current_lines(self, doc_id, lines):
+        """Normalized line vectors of doc_id if it was indexed with exactly these lines, else None."""
+        pos = self.positions.get(doc_id)
+        if pos is None or self.digests is None or int(self.digests[pos]) != lines_digest(lines):
+            return None
+        return self.lines(doc_id)
+
+    def _rows(self, doc_ids):
+        positions = np.array([self.positions[doc_id] for doc_id in doc_ids], dtype=np.int64)
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        seg_starts = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=seg_starts[1:])
+        rows = np.arange(lengths.sum()) + np.repeat(starts - seg_starts, lengths)
+        return rows, lengths
+
+    def features(self, query_vector, doc_ids):
+        """Feature name -> array with the value of each of doc_ids, see FEATURES."""
+        if len(doc_ids) == 0:
+            return {feature: np.empty(0) for feature in FEATURES}
+        query = normalize_rows(query_vector)
+        rows, lengths = self._rows(doc_ids)
+        return segment_features(self.vectors[rows] @ query, lengths)
+
+    @staticmethod
+    def write(path, docs, encode_batch, batch_lines=4096, fingerprint=None):
+        """Encode every doc's lines straight into a saved index at path, returning it loaded.
+
+        docs yields (doc_id, texts of its lines) - at least one line each -
+        and is read once, ie straight from a scan. encode_batch turns a list
+        of texts into an (n, dims) matrix, fingerprint identifies its model.
+        Lines are encoded batch_lines at a time and appended to disk, so
+        neither the corpus' lines nor its vectors need to fit in memory.
+        """
+        os.makedirs(path, exist_ok=True)
+        raw_path = os.path.join(path, 'vectors.tmp')
+        doc_ids, lengths, digests = [], [], []
+        pending = []
+        dims = None
+
+        def encode_pending(raw, num_lines):
+            nonlocal dims
+            encoded = normalize_rows(encode_batch(pending[:num_lines]))
+            dims = encoded.shape[1]
+            raw.write(encoded.tobytes())
+            del pending[:num_lines]
+
+        with open(raw_path, 'wb') as raw:
+            for doc_id, lines in docs:
+                if len(lines) == 0:
+                    raise ValueError("Every document needs at least one line")
+                doc_ids.append(doc_id)
+                lengths.append(len(lines))
+                digests.append(lines_digest(lines))
+                pending.extend(lines)
+                while len(pending) >= batch_lines:
+                    encode_pending(raw, batch_lines)
+            if len(pending) > 0:
+                encode_pending(raw, len(pending))
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        num_lines = int(offsets[-1])
+        vectors = np.lib.format.open_memmap(os.path.join(path, 'vectors.npy'), mode='w+',
+                                            dtype=np.float32, shape=(num_lines, dims or 0))
+        if num_lines > 0:
+            appended = np.memmap(raw_path, dtype=np.float32, mode='r', shape=(num_lines, dims))
+            for start in range(0, num_lines, batch_lines):
+                vectors[start:start + batch_lines] = appended[start:start + batch_lines]
+            del appended
+        vectors.flush()
+        del vectors
+        os.remove(raw_path)
+
+        MaxSimIndex(None, offsets, np.array(doc_ids), np.array(digests, dtype=np.uint64),
+                    fingerprint)._save_meta(path, num_lines)
+        return MaxSimIndex.load(path)
+
+    def _save_meta(self, path, num_lines):
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'doc_ids.npy'), self.doc_ids)
+        if self.digests is not None:
+            np.save(os.path.join(path, 'digests.npy'), self.digests)
+        with open(os.path.join(path, 'meta.json'), 'wt') as f:
+            json.dump({'docs': len(self), 'lines': num_lines, 'fingerprint': self.fingerprint}, f)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+        self._save_meta(path, len(self.vectors))
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load a saved index, memory mapping the line vectors."""
+        digests_path = os.path.join(path, 'digests.npy')
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return MaxSimIndex(np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r' if mmap else None),
+                           np.load(os.path.join(path, 'offsets.npy')),
+                           np.load(os.path.join(path, 'doc_ids.npy')),
+                           np.load(digests_path) if os.path.exists(digests_path) else None,
+                           meta.get('fingerprint'))
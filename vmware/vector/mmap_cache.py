@@ -0,0 +1,198 @@
+"""Redis-free vector cache on local disk, shareable between processes.
+
+Vectors are appended to '{path}.vectors' as raw rows, and a 64 bit digest of
+each row's key to '{path}.keys'. The key -> row index is a sorted array of
+digests searched with np.searchsorted (plus a small dict of recent appends),
+16 bytes per vector. Readers memory map the vectors, so many worker
+processes can read one cache file, and get() returns views into the map.
+"""
+import fcntl
+import json
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+
+from .stats import Stats
+from .vector_cache import text_digest
+
+
+DIGEST_BYTES = 8
+MERGE_PENDING_AT = 65536
+
+
+class MmapVectorCache:
+
+    def __init__(self, path, dims, dtype=np.float32, fingerprint=None):
+        self.path = path
+        self.dims = dims
+        self.dtype = np.dtype(dtype)
+        self.fingerprint = fingerprint
+        self.row_bytes = dims * self.dtype.itemsize
+        self.vectors_path = f"{path}.vectors"
+        self.keys_path = f"{path}.keys"
+
+        self._check_header()
+        for file_path in [self.vectors_path, self.keys_path]:
+            open(file_path, 'ab').close()
+
+        self.index_digests = np.empty(0, dtype=np.uint64)
+        self.index_rows = np.empty(0, dtype=np.int64)
+        self.pending = {}
+        self.keys_read = 0
+        self.mapped = None
+        self.metrics = Stats()
+        self.refresh()
+
+    def stats(self, namespace_bytes=True):
+        """Hit / miss counters and lookup / append latency, as VectorCache.stats().
+
+        Keys / bytes on disk are always included, they're known without a scan.
+        """
+        stats = self.metrics.snapshot()
+        stats['namespace'] = {'keys': len(self), 'bytes': len(self) * (self.row_bytes + DIGEST_BYTES)}
+        return stats
+
+    def reset_stats(self):
+        self.metrics.reset()
+
+    def _check_header(self):
+        header = {'dims': self.dims, 'dtype': self.dtype.str, 'fingerprint': self.fingerprint}
+        header_path = f"{self.path}.json"
+        try:
+            with open(header_path, 'rt') as f:
+                on_disk = json.load(f)
+            if on_disk != header:
+                raise ValueError(f"{self.path} holds {on_disk}, not {header}")
+        except FileNotFoundError:
+            with open(header_path, 'wt') as f:
+                json.dump(header, f)
+
+    def _num_rows(self):
+        # Rows are written before their keys, so a key only counts once its row is on disk
+        return min(os.path.getsize(self.keys_path) // DIGEST_BYTES,
+                   os.path.getsize(self.vectors_path) // self.row_bytes)
+
+    def refresh(self):
+        """Pick up rows appended (maybe by other processes) since last read."""
+        num_rows = self._num_rows()
+        if num_rows > self.keys_read:
+            with open(self.keys_path, 'rb') as f:
+                f.seek(self.keys_read * DIGEST_BYTES)
+                digests = np.frombuffer(f.read((num_rows - self.keys_read) * DIGEST_BYTES),
+                                        dtype='<u8')
+            for row, digest in enumerate(digests.tolist(), start=self.keys_read):
+                self.pending.setdefault(digest, row)
+            self.keys_read = num_rows
+            if len(self.pending) >= MERGE_PENDING_AT:
+                self._merge_pending()
+
+        if self.keys_read > 0 and (self.mapped is None or len(self.mapped) < self.keys_read):
+            self.mapped = np.memmap(self.vectors_path, dtype=self.dtype, mode='r',
+                                    shape=(self.keys_read, self.dims))
+
+    def _merge_pending(self):
+        digests = np.concatenate([self.index_digests,
+                                  np.fromiter(self.pending.keys(), dtype=np.uint64)])
+        rows = np.concatenate([self.index_rows,
+                               np.fromiter(self.pending.values(), dtype=np.int64)])
+        order = np.argsort(digests, kind='stable')
+        self.index_digests = digests[order]
+        self.index_rows = rows[order]
+        self.pending = {}
+
+    @staticmethod
+    def _digest(key):
+        return int(text_digest(key)[:16], 16)
+
+    def _lookup(self, digests):
+        """Row of each digest, -1 where not cached."""
+        digests = np.asarray(digests, dtype=np.uint64)
+        rows = np.full(len(digests), -1, dtype=np.int64)
+        if len(self.index_digests) > 0:
+            pos = np.searchsorted(self.index_digests, digests)
+            pos[pos == len(self.index_digests)] = 0
+            found = self.index_digests[pos] == digests
+            rows[found] = self.index_rows[pos[found]]
+        if len(self.pending) > 0:
+            for idx in np.flatnonzero(rows < 0):
+                rows[idx] = self.pending.get(int(digests[idx]), -1)
+        return rows
+
+    def rows(self, keys: List[str]) -> np.ndarray:
+        """Row in the mapped vectors of each key, -1 for misses."""
+        digests = [self._digest(key) for key in keys]
+        rows = self._lookup(digests)
+        if (rows < 0).any() and self._num_rows() > self.keys_read:
+            self.refresh()
+            rows = self._lookup(digests)
+        return rows
+
+    def __len__(self):
+        return self.keys_read
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Read-only view of the cached vector, no copy."""
+        with self.metrics.timer('get_us'):
+            row = self.rows([key])[0]
+        self.metrics.incr('hits' if row >= 0 else 'misses')
+        if row < 0:
+            return None
+        return self.mapped[row]
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        vectors = np.zeros((len(keys), self.dims), dtype=self.dtype)
+        if len(keys) == 0:
+            return vectors, []
+        with self.metrics.timer('get_many_us'):
+            rows = self.rows(keys)
+            found = rows >= 0
+            if found.any():
+                vectors[found] = self.mapped[rows[found]]
+        num_found = int(found.sum())
+        self.metrics.record('get_many_keys', len(keys))
+        self.metrics.incr('hits', num_found)
+        self.metrics.incr('misses', len(keys) - num_found)
+        return vectors, np.flatnonzero(~found).tolist()
+
+    def set(self, key: str, arr: np.ndarray):
+        self.set_many([key], arr.reshape(1, -1))
+
+    def set_many(self, keys: List[str], arrs: np.ndarray):
+        """Append the rows not already cached, under an exclusive file lock."""
+        with self.metrics.timer('set_many_us'):
+            self.metrics.incr('keys_written', self._append(keys, arrs))
+
+    def _append(self, keys, arrs):
+        if len(arrs.shape) != 2 or arrs.shape[0] != len(keys):
+            raise ValueError("Expected one row per key")
+        if arrs.shape[1] != self.dims:
+            raise ValueError(f"Only supports {self.dims} dimensions")
+        if arrs.dtype != self.dtype:
+            msg = (f"Only type {self.dtype} supported you passed arr of {arrs.dtype}")
+            raise ValueError(msg)
+
+        with open(self.keys_path, 'ab') as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                digests = [self._digest(key) for key in keys]
+                new_rows = {}
+                for idx in np.flatnonzero(self._lookup(digests) < 0):
+                    new_rows.setdefault(digests[idx], idx)
+                if len(new_rows) == 0:
+                    return 0
+
+                # Drop anything past the last complete row, left by a writer that died mid append
+                os.ftruncate(keys_file.fileno(), self.keys_read * DIGEST_BYTES)
+                with open(self.vectors_path, 'r+b') as vectors_file:
+                    vectors_file.truncate(self.keys_read * self.row_bytes)
+                    vectors_file.seek(0, os.SEEK_END)
+                    vectors_file.write(np.ascontiguousarray(arrs[list(new_rows.values())]).tobytes())
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                keys_file.write(np.array(list(new_rows.keys()), dtype='<u8').tobytes())
+                keys_file.flush()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+        self.refresh()
+        return len(new_rows)
@@ -1,37 +1,390 @@
-from sentence_transformers import SentenceTransformer
+import asyncio
+import hashlib
+import os
+import warnings
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from .vector_cache import VectorCache
+from .vector_cache import VectorCache, LRUVectorCache, AsyncVectorCache, as_stored
+from .mmap_cache import MmapVectorCache
+from .batching import encode_bucketed, approx_token_length
+from .stats import Stats
 
 
-import redis
-r = redis.Redis(host='localhost', port=6379)
+_redis = None
+
+
+def redis_connection():
+    """Shared Redis client for vector caches, created on first use."""
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis(host='localhost', port=6379)
+    return _redis
+
+
+def async_redis_connection():
+    """New redis.asyncio client for vector caches (async clients belong to one event loop, so aren't shared)."""
+    import redis.asyncio
+    return redis.asyncio.Redis(host='localhost', port=6379)
+
+
+def _model_path(model_name):
+    """Local folder SentenceTransformer loads model_name from, if any."""
+    if os.path.isdir(model_name):
+        return model_name
+    torch_home = os.getenv('TORCH_HOME',
+                           os.path.join(os.getenv('XDG_CACHE_HOME', '~/.cache'), 'torch'))
+    cache_folder = os.getenv('SENTENCE_TRANSFORMERS_HOME',
+                             os.path.join(torch_home, 'sentence_transformers'))
+    cache_folder = os.path.expanduser(cache_folder)
+    for folder_name in [model_name, f"sentence-transformers/{model_name}"]:
+        path = os.path.join(cache_folder, folder_name.replace("/", "_"))
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+_fingerprints = {}
+
+
+def model_fingerprint(model_name, strict=False):
+    """Short digest of the model's files, so new weights under the same name get new cache keys.
+
+    Hashes the name and contents of every file in the model's folder (a
+    fine tuned checkpoint has the same file sizes as its base model).
+    Hashing a few hundred MB of weights takes a moment, so it's memoized
+    per process until a file's size or mtime changes. When the model isn't
+    in a folder _model_path knows, with strict raises FileNotFoundError,
+    otherwise warns and fingerprints the name alone (see
+    weights_fingerprint for a loaded model).
+    """
+    path = _model_path(model_name)
+    if path is None:
+        if strict:
+            raise FileNotFoundError(f"No local files for {model_name}, can't fingerprint its weights")
+        warnings.warn(f"No local files for {model_name}, fingerprinting its name only - "
+                      "new weights under this name will read stale cached vectors")
+        return hashlib.blake2b(model_name.encode('utf-8'), digest_size=4).hexdigest()
+    files = []
+    for root, dirs, file_names in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            stat = os.stat(file_path)
+            files.append((file_path, stat.st_size, stat.st_mtime_ns))
+    memo_key = (model_name, path, tuple(files))
+    if memo_key not in _fingerprints:
+        digest = hashlib.blake2b(model_name.encode('utf-8'), digest_size=4)
+        for file_path, _, _ in files:
+            digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def weights_fingerprint(model_name, model):
+    """Short digest of a loaded (torch) model's state_dict, for models whose files _model_path can't find."""
+    import torch
+    digest = hashlib.blake2b(model_name.encode('utf-8'), digest_size=4)
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        # As raw bytes, so any dtype (ie bfloat16, which numpy lacks) hashes
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
 
 
 class ModelEncoder:
     """A naive cache for SentenceTransformer inference.
 
-    This should just use Redis :)
+    Vectors are cached in Redis, or with cache_dir (or the
+    VMWARE_VECTOR_CACHE_DIR env var) in a memory mapped file per model
+    version under that directory, which needs no Redis server.
+
+    backend picks how inference runs on CPU, see BACKENDS. Backends other
+    than 'torch' (plain fp32) get their own cache keys, as their vectors
+    differ slightly: the backend is a segment after the model fingerprint
+    ('{namespace}:{fingerprint}:int8:...'), so compacting to the current
+    fingerprint keeps every backend's vectors. storage='f16' halves Redis
+    memory, see VectorCache.
+
+    stats() reports cache hit rate, cache and model latency (microseconds)
+    and model batch sizes, reset_stats() zeroes them, ie between benchmark runs.
     """
 
-    def __init__(self, model_name, dims):
+    # 'int8' is experimental: neither its speedup nor its parity with fp32
+    # (test_int8_parity_with_fp32) has been measured on the USE or mpnet
+    # weights yet - run scripts/encoder_benchmark.py before relying on it.
+    BACKENDS = ['torch', 'int8']
+
+    def __init__(self, model_name, dims, local_cache_bytes=64 * 1024 * 1024,
+                 fingerprint=None, cache_dir=None, backend=None, storage=None):
 
-        self.model = SentenceTransformer(model_name)
+        backend = backend or os.getenv('VMWARE_ENCODER_BACKEND', 'torch')
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {self.BACKENDS}")
         self.model_name = model_name
+        self.dims = dims
+        self.backend = backend
+        self.storage = storage
+        self.local_cache_bytes = local_cache_bytes
+        self.cache_dir = cache_dir or os.getenv('VMWARE_VECTOR_CACHE_DIR')
+        # Model, fingerprint and cache are loaded on first use, see warmup()
+        self._model = None
+        self._fingerprint = fingerprint
+        self._cache = None
+        self.metrics = Stats()
+
+    @property
+    def model(self):
+        if self._model is None:
+            # Importing sentence_transformers pulls in torch, so only pay for it when encoding
+            from sentence_transformers import SentenceTransformer
+            if self.backend == 'torch':
+                model = SentenceTransformer(self.model_name)
+            elif self.backend == 'int8':
+                model = SentenceTransformer(self.model_name, device='cpu')
+            if self._fingerprint is None and _model_path(self.model_name) is None:
+                # Files aren't in a folder model_fingerprint knows (ie newer sentence-transformers keep
+                # them in the Hugging Face hub cache), so fingerprint the fp32 weights as loaded
+                self._fingerprint = weights_fingerprint(self.model_name, model)
+            if self.backend == 'int8':
+                # Dynamic int8 quantization of every Linear layer (the bulk of transformer compute)
+                import torch
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._model = model
+        return self._model
+
+    @property
+    def fingerprint(self):
+        """Model version, then the backend as its own key segment - even for a fingerprint passed in."""
+        if self._fingerprint is None:
+            if _model_path(self.model_name) is None:
+                # Not downloaded yet (or not where model_fingerprint looks), load to fetch the files,
+                # which fingerprints the loaded weights if they still aren't found
+                self.model
+            if self._fingerprint is None:
+                self._fingerprint = model_fingerprint(self.model_name)
+        if self.backend != 'torch':
+            return f"{self._fingerprint}:{self.backend}"
+        return self._fingerprint
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            model_base_name = self.model_name.replace("/", "_")
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._cache = MmapVectorCache(os.path.join(self.cache_dir, f"{model_base_name}.{self.fingerprint.replace(':', '.')}"),
+                                              dims=self.dims,
+                                              dtype=np.float32,
+                                              fingerprint=self.fingerprint)
+            else:
+                self._cache = self._redis_cache(VectorCache, redis_connection())
+                if self.local_cache_bytes > 0:
+                    self._cache = LRUVectorCache(self._cache, max_bytes=self.local_cache_bytes)
+        return self._cache
 
-        model_base_name = model_name.replace("/", "_")
-        self.cache = VectorCache(r, namespace=model_base_name,
-                                 dtype=np.float32,
-                                 dims=dims)
+    def _redis_cache(self, cache_class, r):
+        """cache_class (VectorCache or AsyncVectorCache) over r, under this model's namespace and fingerprint."""
+        return cache_class(r, namespace=self.model_name.replace("/", "_"),
+                           dtype=np.float32,
+                           dims=self.dims,
+                           fingerprint=self.fingerprint,
+                           storage=self.storage)
+
+    def warmup(self, cache=True):
+        """Load the model (and cache) now rather than on first encode.
+
+        For long running jobs that would rather pay startup up front. Runs
+        one encode so lazily initialized inference state is ready too.
+        """
+        self.model.encode(["warmup"])
+        if cache:
+            self.cache
+        return self
+
+    def stats(self, **kwargs):
+        """Encoder counters and histograms, with the cache's own stats() once it's loaded."""
+        stats = self.metrics.snapshot()
+        lookups = stats.get('cache_hits', 0) + stats.get('cache_misses', 0)
+        stats['cache_hit_rate'] = stats.get('cache_hits', 0) / lookups if lookups else 0.0
+        if self._cache is not None and hasattr(self._cache, 'stats'):
+            stats['cache'] = self._cache.stats(**kwargs)
+        return stats
+
+    def reset_stats(self):
+        self.metrics.reset()
+        if self._cache is not None and hasattr(self._cache, 'reset_stats'):
+            self._cache.reset_stats()
 
     def encode(self, text, cached=False):
         """Embed a single snippet, prefer cached version if available."""
+        self.metrics.incr('texts')
         if cached:
-            cached_value = self.cache.get(text)
+            with self.metrics.timer('cache_get_us'):
+                cached_value = self.cache.get(text)
             if cached_value is not None:
+                self.metrics.incr('cache_hits')
                 return cached_value
+            self.metrics.incr('cache_misses')
 
-        encoded = self.model.encode(text)
+        with self.metrics.timer('forward_us'):
+            encoded = self.model.encode(text)
+        self.metrics.record('batch_size', 1)
         if cached:
-            self.cache.set(text, encoded)
+            with self.metrics.timer('cache_set_us'):
+                self.cache.set(text, encoded)
+            encoded = as_stored(self.cache, encoded)
+        return encoded
+
+    def token_lengths(self, texts):
+        """Tokens in each text as the model sees them (truncated at its max_seq_length)."""
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None:
+            return [approx_token_length(text) for text in texts]
+        input_ids = tokenizer(texts, add_special_tokens=True, truncation=True,
+                              max_length=self.model.max_seq_length)['input_ids']
+        return [len(ids) for ids in input_ids]
+
+    def _encode_texts(self, texts):
+        with self.metrics.timer('forward_us'):
+            encoded = self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        self.metrics.record('batch_size', len(texts))
+        return encoded.astype(np.float32, copy=False)
+
+    def _count_lookups(self, texts, missed):
+        self.metrics.incr('cache_hits', len(texts) - len(missed))
+        self.metrics.incr('cache_misses', len(missed))
+
+    def _encode_missed(self, texts, encoded, missed, batch_size, max_tokens, cache=None):
+        """Fill encoded's missed rows from the model, each distinct text once.
+
+        Returns the distinct texts and their vectors, for writing to the cache.
+        With cache, encoded's rows are as cache will return them (ie float16
+        rounded), so misses match later hits.
+        """
+        unique_texts = list(dict.fromkeys(texts[idx] for idx in missed))
+        vectors = encode_bucketed(self._encode_texts, unique_texts,
+                                  lengths=self.token_lengths(unique_texts),
+                                  max_tokens=max_tokens, max_batch=batch_size)
+        rows = {text: row for row, text in enumerate(unique_texts)}
+        returned = vectors if cache is None else as_stored(cache, vectors)
+        encoded[missed] = returned[[rows[texts[idx]] for idx in missed]]
+        return unique_texts, vectors
+
+    def encode_batch(self, texts, cached=False, batch_size=128, max_tokens=16384):
+        """Embed many snippets as an (n, dims) float32 matrix in input order.
+
+        With cached, all texts are looked up in one round trip, only the
+        misses go through the model, and the new vectors are written back
+        in one pipelined write. Misses are encoded in length bucketed
+        batches of at most batch_size texts / max_tokens padded tokens (see
+        vmware.vector.batching).
+        """
+        texts = list(texts)
+        self.metrics.incr('texts', len(texts))
+        if cached:
+            with self.metrics.timer('cache_get_us'):
+                encoded, missed = self.cache.get_many(texts)
+            self._count_lookups(texts, missed)
+        else:
+            encoded = np.empty((len(texts), self.dims), dtype=np.float32)
+            missed = list(range(len(texts)))
+
+        if len(missed) > 0:
+            unique_texts, vectors = self._encode_missed(texts, encoded, missed, batch_size, max_tokens,
+                                                        self.cache if cached else None)
+            if cached:
+                with self.metrics.timer('cache_set_us'):
+                    self.cache.set_many(unique_texts, vectors)
+        return encoded
+
+
+class AsyncModelEncoder:
+    """ModelEncoder for asyncio code, ie many queries in one process.
+
+    Uses the same cache as encoder: with a cache_dir, encoder's own memory
+    mapped file (its calls run on executor), otherwise an AsyncVectorCache
+    with the same keys as encoder's Redis cache, so sync and async encoders
+    share vectors. Model inference (and loading) runs on executor - by
+    default one thread per encoder, as torch already spreads one forward
+    pass across cores - so the event loop keeps serving other queries.
+    """
+
+    def __init__(self, encoder, executor=None, r=None):
+        self.encoder = encoder
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.r = r
+        self._cache = None
+        self._cache_lock = asyncio.Lock()
+
+    @property
+    def metrics(self):
+        return self.encoder.metrics
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def cache(self):
+        # Concurrent first calls wait for one cache rather than each making their own
+        async with self._cache_lock:
+            if self._cache is None:
+                # Fingerprinting may need to load (ie download) the model, so off the event loop
+                if self.encoder.cache_dir is not None:
+                    self._cache = await self._run(lambda: self.encoder.cache)
+                else:
+                    self._cache = await self._run(self.encoder._redis_cache, AsyncVectorCache,
+                                                  self.r or async_redis_connection())
+        return self._cache
+
+    async def _cache_call(self, name, *args):
+        cache = await self.cache()
+        if isinstance(cache, AsyncVectorCache):
+            return await getattr(cache, name)(*args)
+        return await self._run(getattr(cache, name), *args)
+
+    async def warmup(self, cache=True):
+        await self._run(self.encoder.warmup, False)
+        if cache:
+            await self.cache()
+        return self
+
+    def stats(self):
+        stats = self.encoder.stats()
+        if self._cache is not None:
+            stats['cache'] = self._cache.stats()
+        return stats
+
+    def reset_stats(self):
+        self.encoder.reset_stats()
+        if self._cache is not None:
+            self._cache.reset_stats()
+
+    async def encode(self, text, cached=False):
+        """Embed a single snippet, as ModelEncoder.encode."""
+        encoded = await self.encode_batch([text], cached=cached)
+        return encoded[0]
+
+    async def encode_batch(self, texts, cached=False, batch_size=128, max_tokens=16384):
+        """Embed many snippets as an (n, dims) float32 matrix, as ModelEncoder.encode_batch."""
+        texts = list(texts)
+        self.metrics.incr('texts', len(texts))
+        if cached:
+            with self.metrics.timer('cache_get_us'):
+                encoded, missed = await self._cache_call('get_many', texts)
+            self.encoder._count_lookups(texts, missed)
+        else:
+            encoded = np.empty((len(texts), self.encoder.dims), dtype=np.float32)
+            missed = list(range(len(texts)))
+
+        if len(missed) > 0:
+            unique_texts, vectors = await self._run(self.encoder._encode_missed, texts, encoded, missed,
+                                                    batch_size, max_tokens,
+                                                    await self.cache() if cached else None)
+            if cached:
+                with self.metrics.timer('cache_set_us'):
+                    await self._cache_call('set_many', unique_texts, vectors)
         return encoded
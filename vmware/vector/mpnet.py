@@ -1,8 +1,24 @@
 from .model_encoder import ModelEncoder
 
 model_name = 'all-mpnet-base-v2'
-model = ModelEncoder(model_name, dims=768)
+# Cached as float16, half the Redis memory with cosines within ~1e-3 of float32
+model = ModelEncoder(model_name, dims=768, storage='f16')
 
 
 def encode(text, cached=False):
     return model.encode(text, cached=cached)
+
+
+def encode_batch(texts, cached=False):
+    """(len(texts), dims) matrix, see ModelEncoder.encode_batch."""
+    return model.encode_batch(texts, cached=cached)
+
+
+def fingerprint():
+    """Version of the model (and backend) vectors come from, see ModelEncoder.fingerprint."""
+    return model.fingerprint
+
+
+def warmup():
+    """Load the model and cache now instead of on first encode."""
+    model.warmup()
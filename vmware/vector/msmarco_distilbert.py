@@ -1,8 +1,14 @@
 from .model_encoder import ModelEncoder
 
 model_name = 'msmarco-distilbert-base-v3'
-model = ModelEncoder(model_name, dims=768)
+# Cached as float16, half the Redis memory with cosines within ~1e-3 of float32
+model = ModelEncoder(model_name, dims=768, storage='f16')
 
 
 def encode(text, cached=True):
     return model.encode(text, cached=cached)
+
+
+def warmup():
+    """Load the model and cache now instead of on first encode."""
+    model.warmup()
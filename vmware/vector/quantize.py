@@ -0,0 +1,97 @@
+"""Per dimension uint8 scalar quantization, calibrated on a sample of vectors.
+
+Unlike corpus.quantize (which assumes every value is in [-1, 1]), each dim
+gets its own offset and scale, learned from the values actually seen, so
+all 256 levels are spent on the range a dim really uses.
+"""
+import numpy as np
+
+from .similarity import ExactIndex
+
+
+def dequantize(vectors):
+    """Undo corpus.quantize's 0-255 buckets (to each bucket's center), float vectors are returned as is."""
+    vectors = np.asarray(vectors)
+    if vectors.dtype == np.uint8:
+        return (vectors.astype(np.float32) - 127.5) / 128.0
+    return vectors
+
+
+class ScalarQuantizer:
+
+    def __init__(self, offset, scale):
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @property
+    def dims(self):
+        return len(self.offset)
+
+    @staticmethod
+    def fit(sample, clip=0.0):
+        """Learn each dim's range from sample, ignoring the clip fraction of outliers at each end."""
+        sample = np.asarray(sample, dtype=np.float32)
+        low = np.quantile(sample, clip, axis=0)
+        high = np.quantile(sample, 1.0 - clip, axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        return ScalarQuantizer(low, scale)
+
+    def quantize(self, vectors, chunk_rows=65536):
+        """uint8 codes of vectors, chunk_rows rows at a time - vectors is never copied or modified."""
+        codes = np.empty(vectors.shape, dtype=np.uint8)
+        for start in range(0, len(vectors), chunk_rows):
+            chunk = (vectors[start:start + chunk_rows] - self.offset) / self.scale
+            np.rint(chunk, out=chunk)
+            np.clip(chunk, 0, 255, out=chunk)
+            codes[start:start + chunk_rows] = chunk
+        return codes
+
+    def dequantize(self, codes, chunk_rows=65536):
+        """float32 reconstruction of codes."""
+        vectors = np.empty(codes.shape, dtype=np.float32)
+        for start in range(0, len(codes), chunk_rows):
+            np.multiply(codes[start:start + chunk_rows], self.scale, out=vectors[start:start + chunk_rows])
+            vectors[start:start + chunk_rows] += self.offset
+        return vectors
+
+    def __call__(self, vectors):
+        return self.quantize(vectors)
+
+    def report(self, vectors, num_queries=100, k=10, seed=0):
+        """Reconstruction error of vectors, and recall@k of searching the reconstruction vs float32.
+
+        Queries are num_queries of the vectors themselves, excluded from
+        their own results.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        reconstructed = self.dequantize(self.quantize(vectors))
+        error = reconstructed - vectors
+        cosines = (reconstructed * vectors).sum(axis=1) / \
+            (np.linalg.norm(reconstructed, axis=1) * np.linalg.norm(vectors, axis=1))
+
+        rng = np.random.default_rng(seed)
+        query_rows = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+        queries = vectors[query_rows]
+        expected, _ = ExactIndex(vectors).search(queries, n=k + 1)
+        found, _ = ExactIndex(reconstructed).search(queries, n=k + 1)
+        hits = 0
+        for row, query_expected, query_found in zip(query_rows, expected, found):
+            query_expected = set(query_expected.tolist()) - {row}
+            hits += len(query_expected & (set(query_found.tolist()) - {row}))
+
+        return {'mse': float((error ** 2).mean()),
+                'max_abs_error': float(np.abs(error).max()),
+                'mean_cosine': float(np.nanmean(cosines)),
+                'min_cosine': float(np.nanmin(cosines)),
+                f'recall@{k}': hits / (len(query_rows) * k),
+                'bytes_per_vector': vectors.shape[1],
+                'float32_bytes_per_vector': 4 * vectors.shape[1]}
+
+    def save(self, path):
+        np.savez(path, offset=self.offset, scale=self.scale)
+
+    @staticmethod
+    def load(path):
+        saved = np.load(path)
+        return ScalarQuantizer(saved['offset'], saved['scale'])
@@ -0,0 +1,112 @@
+"""Shrink stored embeddings to fewer dims, by PCA projection or prefix truncation.
+
+A Reducer is fit on a sample of corpus vectors, then applied to both sides:
+enrichments store reducer.transform(doc vectors) and query time scoring
+compares against reducer.transform(query vector), ie via reducer.wrap(encode).
+tradeoff_report shows what each size costs in retrieval quality.
+
+uint8 vectors (corpus.quantize codes, ie corpus_mpnet.pkl) are dequantized
+back to [-1, 1] first. Fit on raw codes, the mean (~127) would swamp the
+float vectors the reducer is applied to at index and query time.
+"""
+import copy
+import numpy as np
+
+from .similarity import ExactIndex
+from .quantize import dequantize
+
+
+class Reducer:
+
+    def __init__(self, dims, mean=None, components=None):
+        self.dims = dims
+        self.mean = mean                # (full_dims,) or None for truncation
+        self.components = components    # (dims, full_dims) or None for truncation
+
+    @staticmethod
+    def fit_pca(sample, dims):
+        """Top dims principal components of sample."""
+        sample = np.asarray(dequantize(sample), dtype=np.float32)
+        if dims > min(sample.shape):
+            raise ValueError(f"Can't keep {dims} components from a {sample.shape} sample")
+        mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        return Reducer(dims, mean=mean, components=np.ascontiguousarray(vt[:dims]))
+
+    @staticmethod
+    def truncation(dims):
+        """Keep just the first dims dims (for Matryoshka style models, or as a baseline)."""
+        return Reducer(dims)
+
+    def transform(self, vectors, normalize=True):
+        """Reduced float32 vectors (one (full_dims,) vector or an (n, full_dims) matrix)."""
+        vectors = np.asarray(dequantize(vectors), dtype=np.float32)
+        if self.components is None:
+            reduced = np.array(vectors[..., :self.dims])
+        else:
+            reduced = (vectors - self.mean) @ self.components.T
+        if normalize:
+            norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+            np.divide(reduced, norms, out=reduced, where=norms > 0)
+        return reduced
+
+    def wrap(self, encode):
+        """An encode function (text, **kwargs -> vector) returning reduced vectors."""
+        def reduced_encode(text, **kwargs):
+            return self.transform(encode(text, **kwargs))
+        return reduced_encode
+
+    def save(self, path):
+        if self.components is None:
+            np.savez(path, dims=self.dims)
+        else:
+            np.savez(path, dims=self.dims, mean=self.mean, components=self.components)
+
+    @staticmethod
+    def load(path):
+        saved = np.load(path)
+        if 'components' not in saved:
+            return Reducer(int(saved['dims']))
+        return Reducer(int(saved['dims']), mean=saved['mean'], components=saved['components'])
+
+
+def reduced_mapping(mapping, dims):
+    """Copy of an enrichment's mapping with every dense_vector field at dims dims."""
+    mapping = copy.deepcopy(mapping)
+    for field in mapping['properties'].values():
+        if field.get('type') == 'dense_vector':
+            field['dims'] = dims
+    return mapping
+
+
+def tradeoff_report(vectors, dims_list=[32, 64, 128, 256], methods=['pca', 'truncation'],
+                    k=10, num_queries=200, seed=0):
+    """Quality vs size of each reduction, as a list of dicts.
+
+    The reducer is fit on half the vectors and evaluated on the other half:
+    recall@k of nearest neighbors in the reduced space vs the full space
+    (queries are held out vectors, excluding themselves), and bytes per
+    stored float32 vector.
+    """
+    vectors = np.asarray(dequantize(vectors), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    shuffled = vectors[rng.permutation(len(vectors))]
+    fit, held_out = shuffled[:len(shuffled) // 2], shuffled[len(shuffled) // 2:]
+    query_rows = np.arange(min(num_queries, len(held_out)))
+    expected, _ = ExactIndex(held_out).search(held_out[query_rows], n=k + 1)
+
+    report = []
+    for method in methods:
+        for dims in dims_list:
+            if dims >= vectors.shape[1]:
+                continue
+            reducer = Reducer.fit_pca(fit, dims) if method == 'pca' else Reducer.truncation(dims)
+            reduced = reducer.transform(held_out)
+            found, _ = ExactIndex(reduced).search(reduced[query_rows], n=k + 1)
+            hits = sum(len((set(e.tolist()) - {row}) & (set(f.tolist()) - {row}))
+                       for row, e, f in zip(query_rows, expected, found))
+            report.append({'method': method, 'dims': dims,
+                           'bytes_per_vector': 4 * dims,
+                           'size_vs_full': dims / vectors.shape[1],
+                           f'recall@{k}': hits / (len(query_rows) * k)})
+    return report
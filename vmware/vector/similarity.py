@@ -2,26 +2,125 @@ import numpy as np
 import pandas as pd
 
 
+class ExactIndex:
+    """Exact cosine nearest neighbors over a fixed set of vectors.
+
+    float32 vectors are normalized once into one contiguous matrix. uint8
+    vectors (from corpus.quantize) stay one byte per dim, and are recentered
+    a block at a time at query time. Queries are scored against block_rows
+    rows at a time (blocked matmul + argpartition), so scratch memory stays
+    under memory_budget bytes regardless of corpus size.
+    """
+
+    def __init__(self, vectors, memory_budget=256 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        if vectors.dtype == np.uint8:
+            self.matrix = np.ascontiguousarray(vectors)
+            norms = np.empty(len(self.matrix), dtype=np.float32)
+            for start, end in self._blocks(1):
+                norms[start:end] = np.linalg.norm(self._block(start, end), axis=1)
+            self.inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        else:
+            self.matrix = np.array(vectors, dtype=np.float32, order='C')
+            for start, end in self._blocks(1):
+                block = self.matrix[start:end]
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                np.divide(block, norms, out=block, where=norms > 0)
+            self.inv_norms = None
+
+    @staticmethod
+    def from_series(vectors: pd.Series, **kwargs):
+        """Build from a column of vectors, ie a passage dataframe's vector column."""
+        return ExactIndex(np.stack(vectors.to_list()), **kwargs)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def dims(self):
+        return self.matrix.shape[1]
+
+    def _block_rows(self, num_queries):
+        # float32 copy of the block, plus scores and candidate scratch per query
+        row_bytes = 4 * self.dims + 12 * num_queries
+        return max(1, self.memory_budget // row_bytes)
+
+    def _blocks(self, num_queries):
+        block_rows = self._block_rows(num_queries)
+        for start in range(0, len(self.matrix), block_rows):
+            yield start, min(start + block_rows, len(self.matrix))
+
+    def _block(self, start, end):
+        block = self.matrix[start:end]
+        if block.dtype == np.uint8:
+            # quantize() buckets [-1, 1] into 0-255, so bucket 127.5 is zero
+            return block.astype(np.float32) - 127.5
+        return block
+
+    def search(self, query_vectors, n=100):
+        """Top n (indices, scores) by cosine, best first.
+
+        query_vectors is a single (dims,) vector, giving (n,) arrays, or a
+        (num_queries, dims) matrix, giving (num_queries, n) arrays.
+        """
+        single = query_vectors.ndim == 1
+        queries = np.atleast_2d(query_vectors)
+        if queries.dtype == np.uint8:
+            queries = queries.astype(np.float32) - 127.5
+        else:
+            queries = queries.astype(np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = np.divide(queries, norms, out=np.zeros_like(queries), where=norms > 0)
+        n = min(n, len(self.matrix))
+
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start, end in self._blocks(len(queries)):
+            scores = queries @ self._block(start, end).T
+            if self.inv_norms is not None:
+                scores *= self.inv_norms[start:end]
+
+            k = min(n, end - start)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            cand_idx = np.concatenate([best_idx, top + start], axis=1)
+            cand_scores = np.concatenate([best_scores,
+                                          np.take_along_axis(scores, top, axis=1)], axis=1)
+            if cand_idx.shape[1] > n:
+                keep = np.argpartition(-cand_scores, n - 1, axis=1)[:, :n]
+                cand_idx = np.take_along_axis(cand_idx, keep, axis=1)
+                cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            best_idx, best_scores = cand_idx, cand_scores
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        if single:
+            return best_idx[0], best_scores[0]
+        return best_idx, best_scores
+
+
 def exact_nearest_neighbors(query_vector, matrix, n=100):
     """ nth nearest neighbors as array
         with indices of nearest neighbors"""
-    # exact_nearest_neighbors.normed = np.linalg.norm(matrix, axis=1)
+    return ExactIndex(matrix).search(query_vector, n=n)
 
-    dotted = np.dot(matrix, query_vector)
-    # nn = np.divide(dotted, exact_nearest_neighbors.normed)
-    top_n = np.argpartition(-nn, n)[:n]
-    return top_n, nn[top_n]
 
+def similarity(query, encoder, corpus, column, n=10, index=None, reducer=None):
+    """Top n rows of corpus by cosine of column to the encoded query.
 
-def similarity(query, encoder, corpus, column, n=10):
+    Pass an ExactIndex built from corpus[column] to avoid rebuilding it per query.
+    With a reducer (vmware.vector.reduce) both sides are compared in its
+    smaller space, so a passed index should hold reduced vectors.
+    """
     query_vector = encoder(query)
-    vectors = corpus[column]
-    vectors = np.array(vectors.to_list())
-
-    top_n, scores = exact_nearest_neighbors(query_vector, vectors, n=n)
-    top_n = pd.DataFrame({'icol': top_n, 'scores': scores})
-    top_n = top_n.set_index('icol').sort_values('scores', ascending=False)
-    top_n_corpus = corpus.iloc[top_n.index].copy()
-    top_n_corpus['scores'] = sorted(scores, reverse=True)
+    if reducer is not None:
+        query_vector = reducer.transform(query_vector)
+    if index is None:
+        vectors = np.stack(corpus[column].to_list())
+        index = ExactIndex(vectors if reducer is None else reducer.transform(vectors))
+
+    top_n, scores = index.search(query_vector, n=n)
+    top_n_corpus = corpus.iloc[top_n].copy()
+    top_n_corpus['scores'] = scores
 
     return top_n_corpus
@@ -0,0 +1,88 @@
+"""Cheap always-on counters and histograms for encoders and vector caches.
+
+Histograms bucket values by power of two (math.frexp), so recording is a few
+dict updates under a lock, and quantiles are read from the bucket bounds -
+good to within 2x, which is plenty to tell a Redis round trip from a model
+forward pass. Latencies are recorded in microseconds.
+"""
+import math
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}   # exponent -> count of values in [2 ** (exponent - 1), 2 ** exponent)
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        exponent = math.frexp(value)[1] if value > 0 else 0
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return float(min(2 ** exponent, self.max))
+        return float(self.max)
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': self.max}
+
+
+class Stats:
+    """Named counters and histograms, safe to update from many threads."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, value):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].record(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Record the block's wall time in microseconds under name."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, 1e6 * (perf_counter() - start))
+
+    def snapshot(self):
+        """Plain dict of every counter and each histogram's summary."""
+        with self.lock:
+            snapshot = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                snapshot[name] = histogram.summary()
+        return snapshot
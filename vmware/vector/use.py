@@ -9,3 +9,18 @@ def encode(text, cached=False):
     encoded = model.encode(text, cached=cached)
     assert encoded.shape == (512,)
     return encoded
+
+
+def encode_batch(texts, cached=False):
+    """(len(texts), dims) matrix, see ModelEncoder.encode_batch."""
+    return model.encode_batch(texts, cached=cached)
+
+
+def fingerprint():
+    """Version of the model (and backend) vectors come from, see ModelEncoder.fingerprint."""
+    return model.fingerprint
+
+
+def warmup():
+    """Load the model and cache now instead of on first encode."""
+    model.warmup()
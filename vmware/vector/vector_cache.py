@@ -1,17 +1,95 @@
+import hashlib
+import re
 import numpy as np
-from typing import Optional
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from .stats import Stats
+
+
+def text_digest(text: str) -> str:
+    """Fixed size digest of text used in place of the text in cache keys."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+_hashed_key = re.compile(r'^(.+):[0-9a-f]{32}$')
+
+
+def key_prefix(namespace, fingerprint=None, storage=None):
+    """Prefix shared by every key of one namespace at one model version (and storage dtype)."""
+    prefix = namespace if fingerprint is None else f"{namespace}:{fingerprint}"
+    if storage is not None:
+        prefix += f":{storage}"
+    return prefix
+
+
+STORAGE_DTYPES = {'f16': np.float16}
+
+
+def to_storage(arrs: np.ndarray, storage_dtype) -> np.ndarray:
+    """Contiguous copy of arrs as stored (ie float16), a no-op if already in storage_dtype."""
+    return np.ascontiguousarray(arrs, dtype=storage_dtype)
+
+
+def from_storage(encoded, out: np.ndarray, storage_dtype):
+    """Decode stored bytes into out, converting from storage_dtype in the one copy."""
+    out[...] = np.frombuffer(encoded, dtype=storage_dtype)
+
+
+def as_stored(cache, arrs: np.ndarray) -> np.ndarray:
+    """arrs as cache would read them back, ie rounded through float16 (as is for caches that don't round)."""
+    return cache.as_stored(arrs) if hasattr(cache, 'as_stored') else arrs
 
 
 class VectorCache:
+    """Vectors in Redis keyed by '{namespace}:{fingerprint}:{digest of text}'.
 
-    def __init__(self, r, namespace, dims, dtype):
+    The fingerprint identifies the model version, so a model that changes
+    under the same name doesn't reuse stale vectors. Hits, misses, keys per
+    call and Redis latency (in microseconds) are readable from stats().
+
+    With storage='f16', float32 vectors are stored as float16 (half the
+    bytes) under '{namespace}:{fingerprint}:f16:...', and still read back
+    as dtype. as_stored() rounds fresh vectors the same way, so a caller
+    can hand out what a later hit would return.
+    """
+
+    def __init__(self, r, namespace, dims, dtype, fingerprint=None, storage=None):
+        if storage is not None and storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown storage {storage}, expected one of {list(STORAGE_DTYPES)}")
         self.r = r
         self.dtype = dtype
         self.dims = dims
         self.namespace = namespace
+        self.fingerprint = fingerprint
+        self.storage = storage
+        self.storage_dtype = np.dtype(STORAGE_DTYPES[storage] if storage else dtype)
+        self.prefix = key_prefix(namespace, fingerprint, storage)
+        self.row_bytes = dims * self.storage_dtype.itemsize
+        self.metrics = Stats()
 
-    def set(self, key: str, arr: np.ndarray):
-        """Store given Numpy array 'a' in Redis under key 'n'."""
+    def stats(self, namespace_bytes=False):
+        """Counters and latency histograms, plus with namespace_bytes the keys / bytes under
+        this cache's prefix (a SCAN of the keyspace, so not for hot paths)."""
+        stats = self.metrics.snapshot()
+        if namespace_bytes:
+            stats['namespace'] = scan_namespaces(self.r, match=f"{self.prefix}:*").get(
+                self.prefix, {'keys': 0, 'bytes': 0})
+        return stats
+
+    def reset_stats(self):
+        self.metrics.reset()
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{text_digest(key)}"
+
+    def as_stored(self, arrs: np.ndarray) -> np.ndarray:
+        if self.storage_dtype == self.dtype:
+            return arrs
+        return to_storage(arrs, self.storage_dtype).astype(self.dtype)
+
+    def _check(self, arr: np.ndarray):
         if len(arr.shape) > 1:
             raise ValueError("Only supports vectors")
 
@@ -21,31 +99,316 @@ class VectorCache:
         if arr.dtype != self.dtype:
             msg = (f"Only type {self.dtype} supported you passed arr of {arr.dtype}")
             raise ValueError(msg)
-        encoded = arr.tobytes()
+
+    def _decode(self, encoded) -> Optional[np.ndarray]:
+        if encoded is None or len(encoded) != self.row_bytes:
+            return None
+        if self.storage_dtype == self.dtype:
+            return np.frombuffer(encoded, dtype=self.dtype)
+        arr = np.empty(self.dims, dtype=self.dtype)
+        from_storage(encoded, arr, self.storage_dtype)
+        return arr
+
+    def set(self, key: str, arr: np.ndarray):
+        """Store given Numpy array 'a' in Redis under key 'n'."""
+        self._check(arr)
+        encoded = to_storage(arr, self.storage_dtype).tobytes()
 
         # Store encoded data in Redis
-        key = f"{self.namespace}:{key}"
-        self.r.set(key, encoded)
+        with self.metrics.timer('set_us'):
+            self.r.set(self._key(key), encoded)
+        self.metrics.incr('keys_written')
 
     def get(self, key: str) -> Optional[np.ndarray]:
         """Retrieve Numpy array from Redis key 'n'."""
-        key = f"{self.namespace}:{key}"
-        encoded = self.r.get(key)
-        if encoded is None:
+        with self.metrics.timer('get_us'):
+            arr = self._decode(self.r.get(self._key(key)))
+        self.metrics.incr('hits' if arr is not None else 'misses')
+        return arr
+
+    def _encoded_rows(self, keys: List[str], arrs: np.ndarray):
+        """(key, value) to SET for each row of arrs."""
+        if len(arrs.shape) != 2 or arrs.shape[0] != len(keys):
+            raise ValueError("Expected one row per key")
+        if arrs.shape[1] != self.dims:
+            raise ValueError(f"Only supports {self.dims} dimensions")
+        if arrs.dtype != self.dtype:
+            msg = (f"Only type {self.dtype} supported you passed arr of {arrs.dtype}")
+            raise ValueError(msg)
+
+        # Slice each row out of one flat buffer, redis-py writes memoryviews as is
+        rows = memoryview(to_storage(arrs, self.storage_dtype)).cast('B')
+        row_bytes = self.row_bytes
+        return [(self._key(key), rows[idx * row_bytes:(idx + 1) * row_bytes])
+                for idx, key in enumerate(keys)]
+
+    def _decode_rows(self, values) -> Tuple[np.ndarray, List[int]]:
+        """(n, dims) matrix of MGET values, and the indices that missed (left as zeros)."""
+        vectors = np.zeros((len(values), self.dims), dtype=self.dtype)
+        # Copy each value straight into its row of the matrix's buffer
+        rows = memoryview(vectors).cast('B')
+        row_bytes = self.row_bytes
+        same_dtype = self.storage_dtype == self.dtype
+        missed = []
+        for idx, encoded in enumerate(values):
+            if encoded is None or len(encoded) != row_bytes:
+                missed.append(idx)
+            elif same_dtype:
+                rows[idx * row_bytes:(idx + 1) * row_bytes] = encoded
+            else:
+                from_storage(encoded, vectors[idx], self.storage_dtype)
+        self.metrics.record('get_many_keys', len(values))
+        self.metrics.incr('hits', len(values) - len(missed))
+        self.metrics.incr('misses', len(missed))
+        return vectors, missed
+
+    def set_many(self, keys: List[str], arrs: np.ndarray):
+        """Store row i of the (n, dims) matrix arrs under keys[i], in one pipelined write."""
+        pipe = self.r.pipeline(transaction=False)
+        for key, value in self._encoded_rows(keys, arrs):
+            pipe.set(key, value)
+        with self.metrics.timer('set_many_us'):
+            pipe.execute()
+        self.metrics.incr('keys_written', len(keys))
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Retrieve all keys with a single MGET.
+
+        Returns an (n, dims) matrix and the indices of keys that missed, whose
+        rows are left as zeros.
+        """
+        if len(keys) == 0:
+            return np.zeros((0, self.dims), dtype=self.dtype), []
+        with self.metrics.timer('get_many_us'):
+            values = self.r.mget([self._key(key) for key in keys])
+        return self._decode_rows(values)
+
+
+class AsyncVectorCache(VectorCache):
+    """VectorCache on a redis.asyncio client, with the same keys and values.
+
+    So sync and async clients of one namespace and fingerprint share one
+    cache. Every method but stats() is a coroutine.
+    """
+
+    def stats(self):
+        """Counters and latency histograms (namespace bytes need a sync client, see scan_namespaces)."""
+        return self.metrics.snapshot()
+
+    async def set(self, key: str, arr: np.ndarray):
+        self._check(arr)
+        with self.metrics.timer('set_us'):
+            await self.r.set(self._key(key), to_storage(arr, self.storage_dtype).tobytes())
+        self.metrics.incr('keys_written')
+
+    async def get(self, key: str) -> Optional[np.ndarray]:
+        with self.metrics.timer('get_us'):
+            arr = self._decode(await self.r.get(self._key(key)))
+        self.metrics.incr('hits' if arr is not None else 'misses')
+        return arr
+
+    async def set_many(self, keys: List[str], arrs: np.ndarray):
+        pipe = self.r.pipeline(transaction=False)
+        for key, value in self._encoded_rows(keys, arrs):
+            pipe.set(key, value)
+        with self.metrics.timer('set_many_us'):
+            await pipe.execute()
+        self.metrics.incr('keys_written', len(keys))
+
+    async def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        if len(keys) == 0:
+            return np.zeros((0, self.dims), dtype=self.dtype), []
+        with self.metrics.timer('get_many_us'):
+            values = await self.r.mget([self._key(key) for key in keys])
+        return self._decode_rows(values)
+
+
+class LRUVectorCache:
+    """Bounded in-process LRU tier in front of another vector cache.
+
+    Holds at most max_bytes of vector data, evicting the least recently used
+    entries. Misses fall through to the backing cache (ie a VectorCache on
+    Redis) and backing hits are kept locally for next time.
+    """
+
+    def __init__(self, backing, max_bytes=64 * 1024 * 1024):
+        self.backing = backing
+        self.dims = backing.dims
+        self.dtype = backing.dtype
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.lru = OrderedDict()
+        self.lock = Lock()
+        self.reset_stats()
+
+    def as_stored(self, arrs: np.ndarray) -> np.ndarray:
+        return as_stored(self.backing, arrs)
+
+    def reset_stats(self):
+        with self.lock:
+            self.counters = {'local': {'hits': 0, 'misses': 0, 'evictions': 0},
+                             'remote': {'hits': 0, 'misses': 0}}
+        if hasattr(self.backing, 'reset_stats'):
+            self.backing.reset_stats()
+
+    def stats(self, **kwargs):
+        """Hit / miss / eviction counters per tier, and the backing cache's own stats()."""
+        with self.lock:
+            stats = {tier: dict(counters) for tier, counters in self.counters.items()}
+            stats['local']['entries'] = len(self.lru)
+            stats['local']['bytes'] = self.nbytes
+        if hasattr(self.backing, 'stats'):
+            stats['backing'] = self.backing.stats(**kwargs)
+        return stats
+
+    def _put(self, key, arr):
+        if arr.nbytes > self.max_bytes:
+            return
+        # Keep a private, read-only copy so callers can't mutate cached vectors
+        arr = np.array(arr, dtype=self.dtype)
+        arr.setflags(write=False)
+        with self.lock:
+            if key in self.lru:
+                self.nbytes -= self.lru.pop(key).nbytes
+            self.lru[key] = arr
+            self.nbytes += arr.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.lru.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.counters['local']['evictions'] += 1
+
+    def _count_remote(self, hits, misses):
+        # Same lock as the local counters, so concurrent lookups don't lose counts
+        with self.lock:
+            self.counters['remote']['hits'] += hits
+            self.counters['remote']['misses'] += misses
+
+    def _lookup(self, key):
+        with self.lock:
+            arr = self.lru.get(key)
+            if arr is None:
+                self.counters['local']['misses'] += 1
+                return None
+            self.lru.move_to_end(key)
+            self.counters['local']['hits'] += 1
+            return arr
+
+    def set(self, key: str, arr: np.ndarray):
+        self.backing.set(key, arr)
+        # Keep what the backing cache stored (ie float16 rounded), so local and remote hits agree
+        self._put(key, self.as_stored(arr))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        arr = self._lookup(key)
+        if arr is not None:
+            return arr
+        arr = self.backing.get(key)
+        if arr is None:
+            self._count_remote(0, 1)
             return None
-        a = np.frombuffer(encoded, dtype=self.dtype)
-        if a.shape[0] == self.dims:
-            return a
-        return None
+        self._count_remote(1, 0)
+        self._put(key, arr)
+        return arr
+
+    def set_many(self, keys: List[str], arrs: np.ndarray):
+        self.backing.set_many(keys, arrs)
+        for key, arr in zip(keys, self.as_stored(arrs)):
+            self._put(key, arr)
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        vectors = np.zeros((len(keys), self.dims), dtype=self.dtype)
+        local_missed = []
+        for idx, key in enumerate(keys):
+            arr = self._lookup(key)
+            if arr is None:
+                local_missed.append(idx)
+            else:
+                vectors[idx] = arr
+        if len(local_missed) == 0:
+            return vectors, []
+
+        remote, remote_missed = self.backing.get_many([keys[idx] for idx in local_missed])
+        self._count_remote(len(local_missed) - len(remote_missed), len(remote_missed))
+        vectors[local_missed] = remote
+
+        remote_missed_set = set(remote_missed)
+        for row, idx in enumerate(local_missed):
+            if row not in remote_missed_set:
+                self._put(keys[idx], remote[row])
+        return vectors, [local_missed[row] for row in remote_missed]
 
 
 class NullVectorCache:
 
-    def __init__(self):
-        pass
+    def __init__(self, dims=0, dtype=np.float32):
+        self.dims = dims
+        self.dtype = dtype
 
     def set(self, key, arr):
         pass
 
     def get(self, key):
         return None
+
+    def set_many(self, keys, arrs):
+        pass
+
+    def get_many(self, keys):
+        return np.zeros((len(keys), self.dims), dtype=self.dtype), list(range(len(keys)))
+
+
+def _decoded(key):
+    return key.decode('utf-8') if isinstance(key, bytes) else key
+
+
+def _scan_batches(r, match, count):
+    batch = []
+    for key in r.scan_iter(match=match, count=count):
+        batch.append(_decoded(key))
+        if len(batch) >= count:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def scan_namespaces(r, match='*', count=1000):
+    """Summarize cached vectors by key prefix without blocking Redis.
+
+    Walks the keyspace with SCAN, measuring each batch with one pipeline of
+    MEMORY USAGE calls. Returns {prefix: {'keys': n, 'bytes': n}}, where
+    prefix is '{namespace}:{fingerprint}' for digest keys, or just the
+    namespace for old '{namespace}:{text}' keys.
+    """
+    summary = {}
+    for batch in _scan_batches(r, match, count):
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.memory_usage(key)
+        for key, nbytes in zip(batch, pipe.execute()):
+            hashed = _hashed_key.match(key)
+            prefix = hashed.group(1) if hashed else key.split(':', 1)[0]
+            if prefix not in summary:
+                summary[prefix] = {'keys': 0, 'bytes': 0}
+            summary[prefix]['keys'] += 1
+            summary[prefix]['bytes'] += nbytes or 0
+    return summary
+
+
+def drop_namespace(r, prefix, keep=None, count=1000):
+    """UNLINK every key under prefix, in SCAN sized batches.
+
+    With keep, only keys outside '{prefix}:{keep}:' are dropped - ie pass a
+    model namespace and its current fingerprint to compact away vectors
+    from old model versions (and old text keys), keeping every backend and
+    storage dtype of the current version. Returns number of keys dropped.
+    """
+    kept = None if keep is None else f"{prefix}:{keep}:"
+    dropped = 0
+    for batch in _scan_batches(r, f"{prefix}:*", count):
+        if kept is not None:
+            batch = [key for key in batch if not key.startswith(kept)]
+        if len(batch) > 0:
+            r.unlink(*batch)
+            dropped += len(batch)
+    return dropped